@@ -1,6 +1,10 @@
 from flask import Flask
 from dotenv import load_dotenv
 from extensions import cors
+from cli import register_commands
+from migrations import check_schema
+from mail import start_mail_worker
+from serialization import FastJSONProvider
 from routes.main_routes import *
 import config
 import os
@@ -18,7 +22,9 @@ for var in config.required_env_vars:
 
 def create_app():
     app = Flask(__name__)
-    
+    # Сериализация ответов: orjson, без отступов
+    app.json = FastJSONProvider(app)
+
     # Регистрация расширений
     cors.init_app(app)
 
@@ -30,11 +36,17 @@ def create_app():
     app.config["SECRET_KEY"] = SECRET_KEY
     setup_middleware(app)
 
+    # CLI-команды (flask --app api ...)
+    register_commands(app)
+
     return app
 
 app = create_app()
 
 if __name__ == '__main__':
     logging.info("Сервер запущен")
+    # Под gunicorn схема сверяется и отправка писем запускается в post_worker_init
+    check_schema()
+    start_mail_worker()
     app.run(port=5000, debug=config.DEBUG, host='0.0.0.0')
     
\ No newline at end of file
@@ -0,0 +1,227 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from concurrency import native_lock, native_sleep, start_native_thread
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "/var/log/olympiad/audit.log")
+AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(5 * 1024 * 1024)))
+AUDIT_BACKUP_COUNT = int(os.getenv("AUDIT_BACKUP_COUNT", "3"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "256"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "0.5"))
+# Формат строк: JSON lines или обычный текст
+AUDIT_JSON = os.getenv("AUDIT_JSON", "False").lower() in ["true", "1"]
+# Отдельный файл на процесс (audit.log.<pid>) вместо общего файла с блокировкой
+AUDIT_PER_PROCESS = os.getenv("AUDIT_PER_PROCESS", "False").lower() in ["true", "1"]
+
+TEXT_FORMATTER = logging.Formatter('%(levelname)s [%(asctime)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+
+class JSONLineFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S'),
+            "level": record.levelname,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, 'audit', None) or {})
+        return json.dumps(data, ensure_ascii=False)
+
+
+class AuditFileWriter:
+    """
+    Дописывает пачки строк в файл аудита.
+
+    Общий файл защищён flock: ротацию выполняет тот процесс, который держит
+    блокировку, остальные переоткрывают файл, заметив смену inode.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o660)
+
+    def _reopen_if_rotated(self):
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self.fd).st_ino:
+                return False
+        except FileNotFoundError:
+            pass
+        os.close(self.fd)
+        self._open()
+        return True
+
+    def _lock(self):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _rotate(self):
+        for i in range(AUDIT_BACKUP_COUNT - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if AUDIT_BACKUP_COUNT > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.truncate(self.path, 0)
+        os.close(self.fd)
+        self._open()
+
+    def write(self, data):
+        if self.fd is None:
+            self._open()
+        self._lock()
+        try:
+            # Другой процесс мог уже выполнить ротацию
+            if self._reopen_if_rotated():
+                self._lock()
+            os.write(self.fd, data)
+            if AUDIT_MAX_BYTES and os.fstat(self.fd).st_size >= AUDIT_MAX_BYTES:
+                self._rotate()
+        finally:
+            self._unlock()
+
+
+class AsyncAuditHandler(logging.Handler):
+    """
+    Неблокирующий обработчик логгера аудита.
+
+    emit() только кладёт запись в ограниченную очередь; форматирование и
+    запись на диск пачками выполняет фоновый поток ОС (под gevent — тоже
+    настоящий поток: flock и запись в файл не держат воркер). При
+    переполнении очереди запись отбрасывается и учитывается в счётчике dropped.
+    """
+
+    def __init__(self, path, formatter=None):
+        super().__init__()
+        self.path = path
+        self.setFormatter(formatter or TEXT_FORMATTER)
+        self.stats = {"queued": 0, "dropped": 0, "written": 0, "batches": 0, "errors": 0}
+        self._pid = None
+        self._queue = None
+        self._start_lock = threading.Lock()
+        # Счётчики меняют и запросы (emit), и поток записи
+        self._stats_lock = native_lock()
+
+    def _ensure_started(self):
+        # Очередь и поток создаются в каждом процессе заново (после fork)
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            path = f"{self.path}.{os.getpid()}" if AUDIT_PER_PROCESS else self.path
+            # Очередь на настоящей блокировке: её разбирает поток ОС, а не гринлет
+            self._queue = deque()
+            self._queue_lock = native_lock()
+            self._writer = AuditFileWriter(path)
+            self._write_lock = native_lock()
+            start_native_thread(self._run)
+            self._pid = os.getpid()
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def emit(self, record):
+        self._ensure_started()
+        with self._queue_lock:
+            accepted = len(self._queue) < AUDIT_QUEUE_SIZE
+            if accepted:
+                self._queue.append(record)
+        if accepted:
+            self._count(queued=1)
+        else:
+            self._count(dropped=1)
+
+    def _drain(self):
+        with self._queue_lock:
+            count = min(len(self._queue), AUDIT_BATCH_SIZE)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _write_batch(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self._count(errors=1)
+        if not lines:
+            return
+        try:
+            with self._write_lock:
+                self._writer.write(("\n".join(lines) + "\n").encode('utf-8'))
+            self._count(written=len(lines), batches=1)
+        except OSError as e:
+            self._count(errors=1)
+            print(f"Ошибка записи журнала аудита: {e}")
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            if batch:
+                self._write_batch(batch)
+            # Пауза копит следующую пачку; полная пачка значит, что очередь
+            # не успевает разбираться, и следующая пишется сразу
+            if len(batch) < AUDIT_BATCH_SIZE:
+                native_sleep(AUDIT_FLUSH_INTERVAL)
+
+    def flush(self):
+        """Синхронно дописывает всё, что осталось в очереди (при завершении процесса)."""
+        if self._pid != os.getpid() or self._queue is None:
+            return
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write_batch(batch)
+
+
+def _resolve_path(path):
+    directory = os.path.dirname(path)
+    if directory and not os.access(directory, os.W_OK):
+        return os.path.basename(path)
+    return path
+
+
+def setup_audit_logger(logger):
+    """Подключает асинхронный обработчик к логгеру аудита (один раз на процесс)."""
+    for handler in logger.handlers:
+        if isinstance(handler, AsyncAuditHandler):
+            return handler
+
+    handler = AsyncAuditHandler(
+        _resolve_path(AUDIT_LOG_PATH),
+        JSONLineFormatter() if AUDIT_JSON else TEXT_FORMATTER
+    )
+    logger.addHandler(handler)
+    logger.propagate = False
+    atexit.register(handler.flush)
+    return handler
+
+
+def audit_stats(logger):
+    for handler in logger.handlers:
+        if isinstance(handler, AsyncAuditHandler):
+            with handler._stats_lock:
+                stats = dict(handler.stats)
+            stats["pending"] = len(handler._queue) if handler._queue is not None else 0
+            return stats
+    return {}
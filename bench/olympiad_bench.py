@@ -0,0 +1,526 @@
+"""
+Нагрузочный прогон живой олимпиады.
+
+Создаёт временную БД (схема — через migrations.migrate()), N студентов
+и олимпиаду из M вопросов, после чего каждый участник проходит сценарий:
+
+    POST /login -> POST /olympiads/<id>/start
+    -> POST /olympiads/answers (на каждый вопрос) -> POST /olympiads/<result_id>/finish
+
+Запросы идут через тестовый клиент Flask в этом процессе либо по HTTP
+в локальный gunicorn (--gunicorn), запущенный на той же временной БД.
+По каждому шагу печатаются p50/p95/p99, пропускная способность и число
+SQL-запросов на запрос (для gunicorn — из заголовка Server-Timing).
+
+Запуск:
+    python bench/olympiad_bench.py [--users 50] [--questions 20] [--concurrency 8] [--repeat 3]
+    python bench/olympiad_bench.py --save-baseline      # записать bench/baseline.json
+    python bench/olympiad_bench.py --check              # код 1 при регрессии
+
+Базовая линия зависит от машины: её записывают и проверяют на одном
+и том же стенде.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+
+STEPS = ("login", "start", "answer", "finish")
+PASSWORD = "bench-password"
+# Служебные выражения, которые не считаются запросами к данным
+SERVICE_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "SAVEPOINT", "RELEASE")
+SERVER_TIMING_DB_RE = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+# Допустимый рост среднего числа SQL на запрос (промахи кэшей воркера)
+QUERIES_TOLERANCE = 0.5
+
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу; values должен быть отсортирован."""
+    if not values:
+        return None
+    rank = max(1, int(round(q / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+# === Подготовка окружения и данных ===
+
+def prepare_environment(workdir, args):
+    """
+    Настройки читаются модулями при импорте, поэтому окружение
+    задаётся до импорта кода приложения.
+    """
+    os.environ.update({
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "PAYLOAD_CACHE_PATH": os.path.join(workdir, "bench-payloads.db"),
+        "IMAGE_STORE_PATH": os.path.join(workdir, "images"),
+        "AUDIT_LOG_PATH": os.path.join(workdir, "audit.log"),
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "MAIL_WORKER_ENABLED": "0",
+    })
+    os.environ.setdefault("SECRET_KEY", "olympiad-bench-secret-key-not-for-production")
+    # Снимки метрик нужны только воркерам gunicorn; тестовый клиент работает в одном процессе
+    if args.gunicorn:
+        os.environ["METRICS_DIR"] = os.path.join(workdir, "metrics")
+    else:
+        os.environ.pop("METRICS_DIR", None)
+    # api.log пишется в текущий каталог
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def seed(users, questions, seed_value):
+    """Заполняет БД напрямую через SQL; возвращает (id олимпиады, логины, вопросы)."""
+    from database import SQL_request
+    from hashing import hash_password
+    from migrations import migrate
+
+    migrate()
+    rnd = random.Random(seed_value)
+    password_hash = hash_password(PASSWORD)
+
+    creator_id = SQL_request('''
+        INSERT INTO users (first_name, last_name, email, phone, school, role, login, password, is_approved)
+        VALUES ('Bench', 'Teacher', 'teacher@bench.local', '0', 'Bench', 'teacher', 'teacher', ?, 1)
+        RETURNING id
+    ''', (password_hash,))['id']
+
+    logins = []
+    for i in range(users):
+        login = f"student{i}"
+        SQL_request('''
+            INSERT INTO users (first_name, last_name, email, phone, school, role, login, password, is_approved)
+            VALUES (?, 'Bench', ?, '0', 'Bench', 'student', ?, ?, 1)
+        ''', (f"Student{i}", f"{login}@bench.local", login, password_hash))
+        logins.append(login)
+
+    # Время олимпиады хранится в формате '%d-%m-%Y %H:%M' (UTC), как его разбирает start
+    now = datetime.utcnow()
+    olympiad_id = SQL_request('''
+        INSERT INTO olympiads (title, description, creator_id, grading_system, start_time, end_time, duration)
+        VALUES ('Bench', 'Нагрузочный прогон', ?, ?, ?, ?, 180)
+        RETURNING id
+    ''', (
+        creator_id,
+        json.dumps({"5": 85, "4": 70, "3": 50, "2": 0}),
+        (now - timedelta(hours=1)).strftime('%d-%m-%Y %H:%M'),
+        (now + timedelta(days=1)).strftime('%d-%m-%Y %H:%M'),
+    ))['id']
+
+    olympiad_questions = []
+    question_types = ("single", "multiple", "text")
+    for i in range(questions):
+        question_type = question_types[i % len(question_types)]
+        question_id = SQL_request(
+            "INSERT INTO questions (content, type, points) VALUES (?, ?, ?) RETURNING id",
+            (f"Вопрос {i + 1}", question_type, rnd.randint(1, 3))
+        )['id']
+        SQL_request(
+            "INSERT INTO olympiad_questions (olympiad_id, question_id) VALUES (?, ?)",
+            (olympiad_id, question_id)
+        )
+        if question_type == "text":
+            SQL_request(
+                "INSERT INTO answers (question_id, content, is_correct) VALUES (?, ?, 1)",
+                (question_id, f"ответ {i + 1}")
+            )
+            olympiad_questions.append({"id": question_id, "type": question_type, "text": f"ответ {i + 1}"})
+            continue
+        correct = {0} if question_type == "single" else {0, 2}
+        answer_ids = [
+            SQL_request(
+                "INSERT INTO answers (question_id, content, is_correct) VALUES (?, ?, ?) RETURNING id",
+                (question_id, f"Вариант {j + 1}", 1 if j in correct else 0)
+            )['id']
+            for j in range(4)
+        ]
+        olympiad_questions.append({"id": question_id, "type": question_type, "answer_ids": answer_ids})
+
+    from content_versions import bump_content_version
+    bump_content_version('olympiad', olympiad_id)
+    return olympiad_id, logins, olympiad_questions
+
+
+# === Клиенты ===
+
+class QueryCounter:
+    """Считает SQL-выражения основной БД по потокам через trace callback sqlite3."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def install(self):
+        import database
+        original = database._open_connection
+
+        def traced_connection():
+            conn = original()
+            conn.set_trace_callback(self._trace)
+            return conn
+
+        database._open_connection = traced_connection
+
+    def _trace(self, statement):
+        if not statement.lstrip().upper().startswith(SERVICE_STATEMENTS):
+            self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    def value(self):
+        return getattr(self._local, "count", 0)
+
+
+class FlaskClient:
+    """Тестовый клиент Flask: запрос выполняется в вызывающем потоке."""
+
+    def __init__(self, app, counter):
+        self._client = app.test_client()
+        self._counter = counter
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._counter.reset()
+        response = self._client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True), self._counter.value()
+
+
+class HTTPClient:
+    """Клиент для gunicorn: одно keep-alive соединение на участника."""
+
+    def __init__(self, host, port):
+        import http.client
+        self._conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        data = json.dumps(body) if body is not None else None
+        self._conn.request(method, path, body=data, headers=headers)
+        response = self._conn.getresponse()
+        payload = response.read()
+        try:
+            payload = json.loads(payload) if payload else None
+        except ValueError:
+            payload = None
+        match = SERVER_TIMING_DB_RE.search(response.getheader("Server-Timing") or "")
+        return response.status, payload, int(match.group(1)) if match else None
+
+    def close(self):
+        self._conn.close()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def gunicorn_server(workdir, args):
+    port = _free_port()
+    env = dict(os.environ, CONTAINER_PORT=str(port))
+    if args.workers:
+        env["GUNICORN_WORKERS"] = str(args.workers)
+    log = open(os.path.join(workdir, "gunicorn.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+         "--pythonpath", ROOT, "--bind", f"127.0.0.1:{port}", "api:app"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn завершился с кодом {process.returncode}, см. {log.name}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("gunicorn не запустился за 30 секунд")
+                time.sleep(0.2)
+        yield "127.0.0.1", port
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        log.close()
+
+
+# === Сценарий ===
+
+def participant(client, login, olympiad_id, questions, rnd, record):
+    def call(step, method, path, body=None, token=None):
+        started = time.perf_counter()
+        status, payload, queries = client.request(method, path, body, token)
+        record(step, (time.perf_counter() - started) * 1000, queries, status)
+        if status != 200:
+            raise RuntimeError(f"{step}: {method} {path} -> {status} {payload}")
+        return payload
+
+    token = call("login", "POST", "/login", {"login": login, "password": PASSWORD})["token"]
+    result_id = call("start", "POST", f"/olympiads/{olympiad_id}/start", token=token)["result_id"]
+    # start возвращает строку RETURNING id целиком
+    if isinstance(result_id, dict):
+        result_id = result_id["id"]
+
+    for question in questions:
+        if question["type"] == "text":
+            answer = {"answer_text": question["text"] if rnd.random() < 0.7 else "не знаю"}
+        else:
+            count = 1 if question["type"] == "single" else 2
+            answer = {"answer_ids": rnd.sample(question["answer_ids"], count)}
+        call("answer", "POST", "/olympiads/answers",
+             {"result_id": result_id, "question_id": question["id"], "answer": answer}, token=token)
+
+    call("finish", "POST", f"/olympiads/{result_id}/finish", token=token)
+
+
+def run(make_client, logins, olympiad_id, questions, args):
+    """
+    Первые args.warmup участников прогреваются последовательно и в отчёт
+    не попадают: открытие соединений и сборка кэшей — не установившийся режим.
+    Затем args.repeat раундов по args.users новых участников; итог — медиана
+    показателей раундов, чтобы одиночный выброс не давал ложную регрессию.
+    """
+    failures = []
+    lock = threading.Lock()
+
+    def run_participant(index, record):
+        client = make_client()
+        try:
+            participant(client, logins[index], olympiad_id, questions,
+                        random.Random(args.seed + index), record)
+        except Exception as e:
+            with lock:
+                failures.append(f"{logins[index]}: {e}")
+        finally:
+            if hasattr(client, "close"):
+                client.close()
+
+    for index in range(args.warmup):
+        run_participant(index, lambda *sample: None)
+
+    rounds = []
+    for round_index in range(args.repeat):
+        samples = defaultdict(list)
+        errors = defaultdict(int)
+
+        def record(step, elapsed_ms, queries, status):
+            with lock:
+                samples[step].append((elapsed_ms, queries))
+                if status != 200:
+                    errors[step] += 1
+
+        first = args.warmup + round_index * args.users
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(lambda index: run_participant(index, record), range(first, first + args.users)))
+        rounds.append(summarize(samples, errors, time.perf_counter() - started))
+    return median_results(rounds), failures
+
+
+def _latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+    }
+
+
+def summarize(samples, errors, elapsed):
+    steps = {}
+    for step in STEPS:
+        if not samples[step]:
+            continue
+        summary = _latency_summary([elapsed_ms for elapsed_ms, _ in samples[step]])
+        queries = [count for _, count in samples[step] if count is not None]
+        summary["queries_per_request"] = round(sum(queries) / len(queries), 2) if queries else None
+        summary["errors"] = errors[step]
+        steps[step] = summary
+
+    all_latencies = [elapsed_ms for step in samples.values() for elapsed_ms, _ in step]
+    total = _latency_summary(all_latencies) if all_latencies else {"count": 0}
+    total["errors"] = sum(errors.values())
+    total["elapsed_s"] = round(elapsed, 3)
+    total["throughput_rps"] = round(len(all_latencies) / elapsed, 2) if elapsed else None
+    return {"steps": steps, "total": total}
+
+
+def median_results(rounds):
+    """Медиана каждого показателя по раундам; число запросов и ошибок суммируется."""
+    def merge(summaries):
+        merged = {}
+        for name in summaries[0]:
+            values = [summary[name] for summary in summaries if summary.get(name) is not None]
+            if name in ("count", "errors"):
+                merged[name] = sum(values)
+            else:
+                merged[name] = statistics.median(values) if values else None
+        return merged
+
+    steps = {
+        step: merge([results["steps"][step] for results in rounds if step in results["steps"]])
+        for step in rounds[0]["steps"]
+    }
+    return {"steps": steps, "total": merge([results["total"] for results in rounds])}
+
+
+# === Отчёт и базовая линия ===
+
+def format_results(config, results):
+    lines = [
+        "Конфигурация: " + ", ".join(f"{name}={value}" for name, value in config.items()),
+        f"{'шаг':<10}{'запросов':>9}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'SQL/запрос':>12}{'ошибок':>8}",
+    ]
+    for step, summary in list(results["steps"].items()) + [("всего", results["total"])]:
+        queries = summary.get("queries_per_request")
+        lines.append(
+            f"{step:<10}{summary['count']:>9}{summary.get('p50_ms', 0):>10.2f}{summary.get('p95_ms', 0):>10.2f}"
+            f"{summary.get('p99_ms', 0):>10.2f}{'-' if queries is None else queries:>12}{summary['errors']:>8}"
+        )
+    total = results["total"]
+    lines.append(f"Пропускная способность: {total['throughput_rps']} запросов/с (раунд — {total['elapsed_s']} с)")
+    return "\n".join(lines)
+
+
+def compare(baseline, results, tolerance):
+    """Возвращает список регрессий относительно базовой линии."""
+    regressions = []
+    for step, base in baseline["steps"].items():
+        current = results["steps"].get(step)
+        if current is None:
+            regressions.append(f"{step}: шаг отсутствует в прогоне")
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{step}: p95 {current['p95_ms']} мс > {base['p95_ms']} мс (+{tolerance:.0%})")
+        # Число запросов почти детерминировано (колеблется только из-за кэшей)
+        if base.get("queries_per_request") is not None and current.get("queries_per_request") is not None:
+            if current["queries_per_request"] > base["queries_per_request"] + QUERIES_TOLERANCE:
+                regressions.append(
+                    f"{step}: SQL на запрос {current['queries_per_request']} > {base['queries_per_request']}"
+                )
+    base_rps = baseline["total"].get("throughput_rps")
+    if base_rps and results["total"]["throughput_rps"] < base_rps * (1 - tolerance):
+        regressions.append(
+            f"пропускная способность {results['total']['throughput_rps']} < {base_rps} запросов/с (-{tolerance:.0%})"
+        )
+    if results["total"]["errors"]:
+        regressions.append(f"ошибок в прогоне: {results['total']['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон олимпиады")
+    parser.add_argument("--users", type=int, default=50, help="число участников")
+    parser.add_argument("--questions", type=int, default=20, help="число вопросов олимпиады")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременно проходящих участников")
+    parser.add_argument("--repeat", type=int, default=3, help="раундов замера (итог — медиана)")
+    parser.add_argument("--warmup", type=int, default=5, help="участников для прогрева (не входят в отчёт)")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора ответов")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="стоимость bcrypt для участников (в бою 12, в прогоне мешает замерам)")
+    parser.add_argument("--gunicorn", action="store_true", help="прогон по HTTP через локальный gunicorn")
+    parser.add_argument("--workers", type=int, default=None, help="число воркеров gunicorn")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="файл базовой линии (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как базовую линию")
+    parser.add_argument("--check", action="store_true", help="сравнить с базовой линией, код 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение p95 и пропускной способности")
+    parser.add_argument("--json", action="store_true", help="печатать результаты в JSON")
+    args = parser.parse_args(argv)
+
+    config = {
+        "mode": "gunicorn" if args.gunicorn else "client",
+        "users": args.users,
+        "questions": args.questions,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "repeat": args.repeat,
+        "bcrypt_rounds": args.bcrypt_rounds,
+    }
+    if args.gunicorn:
+        config["workers"] = args.workers
+
+    baseline = None
+    if args.check:
+        baseline_path = os.path.abspath(args.baseline)
+        if not os.path.exists(baseline_path):
+            print(f"Базовая линия не найдена: {baseline_path} (запишите её через --save-baseline)")
+            return 2
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"Конфигурация прогона отличается от базовой линии: {baseline['config']}")
+            return 2
+    baseline_path = os.path.abspath(args.baseline)
+
+    workdir = tempfile.mkdtemp(prefix="olympiad-bench-")
+    cwd = os.getcwd()
+    try:
+        prepare_environment(workdir, args)
+        counter = QueryCounter()
+        counter.install()
+        olympiad_id, logins, questions = seed(args.warmup + args.users * args.repeat, args.questions, args.seed)
+
+        # Маршруты печатают отладочный вывод — в отчёт он не попадает
+        with contextlib.redirect_stdout(io.StringIO()):
+            if args.gunicorn:
+                with gunicorn_server(workdir, args) as (host, port):
+                    results, failures = run(lambda: HTTPClient(host, port), logins, olympiad_id, questions, args)
+            else:
+                from api import app
+                from middleware import audit_logger
+                results, failures = run(lambda: FlaskClient(app, counter), logins, olympiad_id, questions, args)
+                # Очередь аудита дописывается до удаления рабочего каталога
+                for handler in audit_logger.handlers:
+                    handler.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"config": config, **results}, ensure_ascii=False, indent=2))
+    else:
+        print(format_results(config, results))
+    for failure in failures[:10]:
+        print(f"Сбой участника {failure}")
+
+    if args.save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"config": config, **results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"Базовая линия записана: {baseline_path}")
+
+    if baseline is not None:
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ {regression}")
+        if regressions:
+            return 1
+        print("Регрессий относительно базовой линии нет")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import click
+from grading import grade_olympiad
+from mail import mail_worker
+from images import migrate_legacy_images
+from database import get_connection
+from migrations import migrate, applied_migrations
+from query_plan import audit, format_report
+
+
+def register_commands(app):
+    @app.cli.command("migrate")
+    @click.option("--target", type=int, default=None, help="Применить миграции до этой версии включительно")
+    @click.option("--status", is_flag=True, help="Показать применённые и ожидающие миграции")
+    def migrate_command(target, status):
+        """Применяет миграции схемы БД (до запуска воркеров)."""
+        if status:
+            for version, name, applied_at in applied_migrations():
+                click.echo(f"{version:04d}_{name}: {applied_at or 'не применена'}")
+            return
+        applied = migrate(target)
+        click.echo(f"Применено миграций: {len(applied)}")
+
+    @app.cli.command("close-olympiad")
+    @click.argument("olympiad_id", type=int)
+    @click.option("--force", is_flag=True, help="Закрыть и идущие попытки текущим временем")
+    def close_olympiad_command(olympiad_id, force):
+        """Проверяет завершившиеся попытки олимпиады (с --force — все)."""
+        summary = grade_olympiad(olympiad_id, force=force)
+        if summary is None:
+            raise click.ClickException(f"Олимпиада {olympiad_id} не найдена")
+        click.echo(
+            f"Олимпиада {olympiad_id}: проверено попыток {summary['graded']}, "
+            f"средний балл {summary['average_score']}/{summary['total_score']}, "
+            f"идущих попыток {summary['active']}, пропущено {summary['skipped']}"
+        )
+
+    @app.cli.command("mail-worker")
+    def mail_worker_command():
+        """Отправляет письма из очереди mail_outbox (отдельный процесс)."""
+        click.echo("Обработка очереди писем запущена")
+        mail_worker.run_forever()
+
+    @app.cli.command("migrate-images")
+    @click.option("--purge", is_flag=True, help="Удалить перенесённые BLOB из таблицы images")
+    def migrate_images_command(purge):
+        """Переносит изображения из таблицы images в хранилище по SHA-256."""
+        moved = migrate_legacy_images(purge=purge)
+        click.echo(f"Перенесено изображений: {moved}")
+
+    @app.cli.command("check-query-plans")
+    @click.option("-v", "--verbose", is_flag=True, help="Печатать планы всех запросов")
+    def check_query_plans_command(verbose):
+        """EXPLAIN QUERY PLAN для SQL из исходников; код 1 при полном переборе."""
+        reports, skipped = audit(get_connection())
+        text, problems = format_report(reports, skipped, verbose=verbose)
+        click.echo(text)
+        if problems:
+            raise SystemExit(1)
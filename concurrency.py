@@ -0,0 +1,94 @@
+"""
+Режим выполнения воркера: sync/gthread или gevent (GUNICORN_WORKER_CLASS).
+
+Под gevent сетевой ввод-вывод (SMTP, сокеты клиентов) кооперативный после
+monkey-patching, а вызовы C-библиотек — SQLite, bcrypt — держат весь воркер.
+Такие вызовы выполняются через run_blocking() в ограниченном пуле настоящих
+потоков: у каждого потока пула своё соединение с БД, а гринлеты запросов
+в это время продолжают обслуживаться.
+"""
+import _thread
+import os
+import threading
+import time
+
+try:
+    from gevent import monkey
+except ImportError:  # gevent не установлен — только sync/gthread
+    monkey = None
+
+# Число потоков пула (и постоянных соединений с БД) на воркер gevent
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "8"))
+
+_pool = None
+_pool_pid = None
+
+
+def gevent_active():
+    """True, если процесс запущен воркером gevent (модули уже пропатчены)."""
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def native_lock():
+    """
+    Настоящая блокировка потоков даже после monkey-patching: её берут
+    потоки пула, а не гринлеты, и она не держится при переключениях.
+    """
+    if gevent_active():
+        return monkey.get_original('threading', 'Lock')()
+    return threading.Lock()
+
+
+def start_native_thread(func, *args):
+    """
+    Запускает настоящий поток ОС и под gevent (обычный Thread стал бы
+    гринлетом и не работал бы, пока воркер занят).
+    """
+    if gevent_active():
+        return monkey.get_original('_thread', 'start_new_thread')(func, args)
+    return _thread.start_new_thread(func, args)
+
+
+def native_thread_id():
+    """Идентификатор потока ОС (под gevent threading.get_ident — id гринлета)."""
+    if gevent_active():
+        return monkey.get_original('_thread', 'get_ident')()
+    return threading.get_ident()
+
+
+def native_sleep(seconds):
+    """Пауза потока ОС без переключения гринлетов (для потоков из start_native_thread)."""
+    if gevent_active():
+        return monkey.get_original('time', 'sleep')(seconds)
+    return time.sleep(seconds)
+
+
+def _blocking_pool():
+    global _pool, _pool_pid
+    # Пул создаётся в каждом воркере заново (после fork)
+    if _pool_pid != os.getpid():
+        from gevent.threadpool import ThreadPool
+        _pool = ThreadPool(BLOCKING_POOL_SIZE)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def run_blocking(func, *args, **kwargs):
+    """Вызывает func в пуле потоков под gevent и напрямую в остальных режимах."""
+    if not gevent_active():
+        return func(*args, **kwargs)
+    # Вызов из потока пула (вложенный SQL_request) выполняется на месте
+    return _blocking_pool().apply(func, args, kwargs)
+
+
+def map_blocking(func, args_list):
+    """Параллельно выполняет func(*args) для каждого набора аргументов в пуле потоков."""
+    if not gevent_active():
+        return [func(*args) for args in args_list]
+    return _blocking_pool().map(lambda args: func(*args), args_list)
+
+
+def blocking_pool_stats():
+    if not gevent_active() or _pool is None or _pool_pid != os.getpid():
+        return {"mode": "gevent" if gevent_active() else "threads"}
+    return {"mode": "gevent", "size": _pool.maxsize, "busy": len(_pool), "queued": _pool.task_queue.qsize()}
@@ -0,0 +1,35 @@
+from database import SQL_request
+
+# Виды содержимого: квизы по id, список открытых тестов (id = 0)
+# и все пользователи (id = 0) — для сброса кэша авторизации в воркерах
+CONTENT_KINDS = ('olympiad', 'test', 'tests', 'users')
+
+
+def get_content_version(kind, content_id=0):
+    """Текущая версия содержимого; 0, если оно ещё не менялось."""
+    row = SQL_request(
+        "SELECT version FROM content_versions WHERE kind = ? AND content_id = ?",
+        (kind, content_id),
+        fetch="one"
+    )
+    return row['version'] if row else 0
+
+
+def bump_content_version(kind, content_id=0):
+    """Увеличивает версию после изменения: ETag и кэш ответа устаревают."""
+    row = SQL_request('''
+        INSERT INTO content_versions (kind, content_id, version)
+        VALUES (?, ?, 1)
+        ON CONFLICT (kind, content_id) DO UPDATE
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    ''', (kind, content_id), fetch="one")
+    return row['version']
+
+
+def bump_creator_content(user_id):
+    """Имя автора входит в ответы по тестам: сбрасываем версии всех его тестов."""
+    tests = SQL_request("SELECT id FROM tests WHERE creator_id = ?", (user_id,), fetch="all")
+    for test in tests:
+        bump_content_version('test', test['id'])
+    bump_content_version('tests')
@@ -4,223 +4,405 @@ from dotenv import load_dotenv
 import os
 import string
 import random
+import threading
+import time
+from concurrency import native_lock, run_blocking
+from query_stats import SQL_EXPLAIN_SLOW, record_query, log_slow_query
 
 load_dotenv()
 
 DB_PATH = os.getenv("DB_PATH")
+# Размер кэша подготовленных выражений на одно соединение
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+# Размер страничного кэша SQLite в КиБ (отрицательное значение для PRAGMA cache_size)
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
 
-def SQL_request(query, params=(), fetch='one', jsonify_result=False):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+# Политика хранения: WAL позволяет читателям не ждать писателя
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Повторы записи при "database is locked"
+DB_WRITE_RETRIES = int(os.getenv("DB_WRITE_RETRIES", "5"))
+DB_WRITE_BACKOFF_MS = int(os.getenv("DB_WRITE_BACKOFF_MS", "25"))
+# Общий срок записи вместе с ожиданием замка и всеми повторами. Заметно меньше
+# таймаута gunicorn (GUNICORN_TIMEOUT): запрос получает ошибку, а не убитый воркер
+DB_WRITE_DEADLINE_MS = int(os.getenv("DB_WRITE_DEADLINE_MS", "10000"))
+
+# PRAGMA, которые применяются один раз при открытии соединения
+CONNECTION_PRAGMAS = (
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    f"PRAGMA synchronous = {DB_SYNCHRONOUS}",
+    f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Формат дат в БД — как у datetime('now') в SQLite: строки сравниваются
+# в порядке времени, и условия по колонке используют индекс
+DB_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Колонки, в которых хранится JSON: декодируются при чтении по имени колонки
+# результата. Для отдельного запроса набор задаётся параметром json_columns.
+JSON_COLUMNS = frozenset({'grading_system', 'answer_ids', 'inventory'})
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # без orjson — стандартный json
+    orjson = None
+    json_loads = json.loads
+
+WRITE_STATEMENTS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER"}
+
+# === Пул соединений: одно постоянное соединение на поток каждого воркера ===
+_local = threading.local()
+_pool_lock = native_lock()
+_pool_stats = {"hits": 0, "misses": 0, "opened": 0, "closed": 0}
+# Соединения всех потоков процесса: закрываются при остановке воркера
+_connections = []
+
+
+def db_datetime(dt):
+    """Дата для записи в БД и сравнения с колонками дат."""
+    return dt.strftime(DB_DATETIME_FORMAT)
+
+
+def _open_connection():
+    # Соединением пользуется только его поток; проверка потока снята, чтобы
+    # при остановке воркера закрыть соединения всех потоков из одного
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_CACHED_STATEMENTS,
+        check_same_thread=False
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """
+    Возвращает постоянное соединение текущего потока.
+
+    После fork (gunicorn preload) соединение родителя не переиспользуется:
+    соединение привязано к PID процесса, в котором было открыто.
+    """
+    conn = getattr(_local, "conn", None)
+    pid = os.getpid()
+    if conn is not None and _local.pid == pid:
+        with _pool_lock:
+            _pool_stats["hits"] += 1
+        return conn
+
+    conn = _open_connection()
+    _local.conn = conn
+    _local.pid = pid
+    with _pool_lock:
+        _pool_stats["misses"] += 1
+        _pool_stats["opened"] += 1
+        _connections.append((pid, conn))
+    return conn
+
+
+def close_connection():
+    """Закрывает соединение текущего потока."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+        with _pool_lock:
+            _pool_stats["closed"] += 1
+            _connections[:] = [item for item in _connections if item[1] is not conn]
+    _local.conn = None
+
+
+def close_all_connections():
+    """
+    Закрывает соединения всех потоков процесса (хук worker_exit в
+    gunicorn.conf.py): последнее закрытое соединение переносит WAL в файл БД.
+    """
+    pid = os.getpid()
+    with _pool_lock:
+        own = [conn for conn_pid, conn in _connections if conn_pid == pid]
+        _connections.clear()
+    for conn in own:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Ошибка закрытия соединения с БД: {e}")
+    with _pool_lock:
+        _pool_stats["closed"] += len(own)
+    return len(own)
+
+
+def pool_stats():
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / total, 4) if total else 0.0
+    stats["pid"] = os.getpid()
+    return stats
+
+
+# === Сериализация записи: один писатель на процесс, повторы с backoff ===
+_write_lock = native_lock()
+_write_stats = {
+    "writes": 0,
+    "retries": 0,
+    "failures": 0,
+    "deadline_exceeded": 0,
+    "lock_wait_ms_total": 0.0,
+    "lock_wait_ms_max": 0.0,
+}
+
+
+class DatabaseBusyError(sqlite3.OperationalError):
+    """База занята дольше DB_WRITE_DEADLINE_MS — запись не выполнена."""
+
+
+def configure_storage(conn=None):
+    """Включает WAL для файла БД. Режим журнала сохраняется в самом файле."""
+    mode = (conn or get_connection()).execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}").fetchone()[0]
+    if mode.upper() != DB_JOURNAL_MODE.upper():
+        print(f"Не удалось включить journal_mode={DB_JOURNAL_MODE}, используется {mode}")
+    return mode
+
+
+def storage_stats():
+    with _pool_lock:
+        stats = dict(_write_stats)
+    stats["lock_wait_ms_total"] = round(stats["lock_wait_ms_total"], 2)
+    stats["lock_wait_ms_max"] = round(stats["lock_wait_ms_max"], 2)
+    stats["lock_wait_ms_avg"] = round(stats["lock_wait_ms_total"] / stats["writes"], 3) if stats["writes"] else 0.0
+    return stats
+
+
+def _is_write(query):
+    words = query.lstrip().split(None, 1)
+    return bool(words) and words[0].upper() in WRITE_STATEMENTS
+
+
+def _is_locked_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _decode_json(value):
+    if isinstance(value, (str, bytes)):
         try:
+            return json_loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _row_mapper(description, json_columns):
+    """
+    Строит преобразование строки в dict один раз на запрос: JSON-колонки
+    определяются по описанию курсора, а не проверкой каждой ячейки.
+    """
+    columns = [desc[0] for desc in description]
+    json_indexes = [i for i, col in enumerate(columns) if col in json_columns]
+    if not json_indexes:
+        return lambda row: dict(zip(columns, row))
+
+    def to_dict(row):
+        result = dict(zip(columns, row))
+        for i in json_indexes:
+            result[columns[i]] = _decode_json(row[i])
+        return result
+    return to_dict
+
+
+def _execute(conn, query, params, fetch, json_columns=JSON_COLUMNS):
+    cursor = conn.cursor()
+    try:
+        # fetch='rows': строки sqlite3.Row без копирования в dict и без
+        # декодирования JSON — для внутренних запросов, читающих пару колонок
+        if fetch == 'rows':
+            cursor.row_factory = sqlite3.Row
+
+        # fetch='many': params — последовательность наборов параметров,
+        # все строки записываются одной транзакцией
+        if fetch == 'many':
+            cursor.executemany(query, params)
+        else:
             cursor.execute(query, params)
 
-            if fetch == 'all':
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                result = [
-                    {
-                        col: json.loads(row[i]) if isinstance(row[i], str) and row[i].startswith('{') else row[i]
-                        for i, col in enumerate(columns)
-                    }
-                    for row in rows
-                ]
-
-            elif fetch == 'one':
-                row = cursor.fetchone()
-                if row:
-                    columns = [desc[0] for desc in cursor.description]
-                    result = {
-                        col: json.loads(row[i]) if isinstance(row[i], str) and row[i].startswith('{') else row[i]
-                        for i, col in enumerate(columns)
-                    }
-                else:
-                    result = None
-            else:
-                conn.commit()
-                result = None
+        if fetch == 'rows':
+            result = cursor.fetchall()
+
+        elif fetch == 'all':
+            rows = cursor.fetchall()
+            to_dict = _row_mapper(cursor.description, json_columns)
+            result = [to_dict(row) for row in rows]
+
+        elif fetch == 'one':
+            row = cursor.fetchone()
+            result = _row_mapper(cursor.description, json_columns)(row) if row else None
+        else:
+            result = None
+
+        # Соединение постоянное, поэтому фиксируем изменения сразу,
+        # как это раньше делал контекстный менеджер sqlite3.connect
+        if conn.in_transaction:
+            conn.commit()
+        return result
+
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        cursor.close()
 
-        except sqlite3.Error as e:
-            print(f"Ошибка SQL: {e}")
-            raise
+
+def _execute_write(conn, query, params, fetch, json_columns):
+    """
+    Выполняет запись через общий для процесса замок писателя.
+
+    Между процессами запись сериализует сама SQLite (busy_timeout), а здесь
+    мы не даём потокам одного воркера толкаться за RESERVED-блокировку и
+    повторяем запрос с экспоненциальной задержкой, если база всё же занята.
+    Ожидание замка, busy_timeout и повторы укладываются в DB_WRITE_DEADLINE_MS;
+    после него бросается DatabaseBusyError.
+    """
+    wait_started = time.perf_counter()
+    deadline = wait_started + DB_WRITE_DEADLINE_MS / 1000
+    if not _write_lock.acquire(timeout=DB_WRITE_DEADLINE_MS / 1000):
+        _record_write_failure(deadline_exceeded=True)
+        raise DatabaseBusyError(f"Замок записи занят дольше {DB_WRITE_DEADLINE_MS} мс")
+    waited_ms = (time.perf_counter() - wait_started) * 1000
+    attempt = 0
+    busy_timeout_ms = DB_BUSY_TIMEOUT_MS
+    try:
+        while True:
+            # busy_timeout не должен выводить попытку за общий срок
+            remaining_ms = int((deadline - time.perf_counter()) * 1000)
+            attempt_timeout_ms = max(1, min(DB_BUSY_TIMEOUT_MS, remaining_ms))
+            if attempt_timeout_ms != busy_timeout_ms:
+                conn.execute(f"PRAGMA busy_timeout = {attempt_timeout_ms}")
+                busy_timeout_ms = attempt_timeout_ms
+            try:
+                return _execute(conn, query, params, fetch, json_columns)
+            except sqlite3.OperationalError as e:
+                if not _is_locked_error(e):
+                    _record_write_failure()
+                    raise
+                backoff = DB_WRITE_BACKOFF_MS * (2 ** attempt) * (0.5 + random.random()) / 1000
+                if attempt >= DB_WRITE_RETRIES or time.perf_counter() + backoff >= deadline:
+                    _record_write_failure(deadline_exceeded=attempt < DB_WRITE_RETRIES)
+                    raise DatabaseBusyError(f"База занята, запись не выполнена за {attempt + 1} попыток: {e}") from e
+                attempt += 1
+                with _pool_lock:
+                    _write_stats["retries"] += 1
+                time.sleep(backoff)
+                waited_ms += backoff * 1000
+    finally:
+        if busy_timeout_ms != DB_BUSY_TIMEOUT_MS:
+            conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        _write_lock.release()
+        with _pool_lock:
+            _write_stats["writes"] += 1
+            _write_stats["lock_wait_ms_total"] += waited_ms
+            _write_stats["lock_wait_ms_max"] = max(_write_stats["lock_wait_ms_max"], waited_ms)
+
+
+def _record_write_failure(deadline_exceeded=False):
+    with _pool_lock:
+        _write_stats["failures"] += 1
+        if deadline_exceeded:
+            _write_stats["deadline_exceeded"] += 1
+
+
+def SQL_request(query, params=(), fetch='one', jsonify_result=False, json_columns=JSON_COLUMNS):
+    # Под gevent запрос выполняется в потоке пула (см. concurrency.py);
+    # учёт — здесь, в потоке запроса, где доступен flask.g
+    started = time.perf_counter()
+    try:
+        return run_blocking(_sql_request, query, params, fetch, jsonify_result, json_columns)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if record_query(query, elapsed_ms):
+            plan = None
+            if SQL_EXPLAIN_SLOW and fetch != 'many':
+                plan = run_blocking(explain_query_plan, query, params)
+            log_slow_query(query, elapsed_ms, plan)
+
+
+def explain_query_plan(query, params=()):
+    """План запроса (строки detail EXPLAIN QUERY PLAN); None, если план не строится."""
+    try:
+        rows = get_connection().execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    except sqlite3.Error:
+        return None
+    return [row[3] for row in rows]
+
+
+def _sql_request(query, params, fetch, jsonify_result, json_columns):
+    conn = get_connection()
+    try:
+        if _is_write(query):
+            result = _execute_write(conn, query, params, fetch, json_columns)
+        else:
+            result = _execute(conn, query, params, fetch, json_columns)
+    except sqlite3.Error as e:
+        print(f"Ошибка SQL: {e}")
+        raise
 
     if jsonify_result and result is not None:
         return json.dumps(result, ensure_ascii=False, indent=2)
     return result
 
-def create_tables():
-    # Пользователи
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        first_name TEXT NOT NULL,
-        last_name TEXT NOT NULL,
-        patronymic TEXT,
-        email TEXT UNIQUE NOT NULL,
-        phone TEXT NOT NULL,
-        school TEXT NOT NULL,
-        role TEXT CHECK(role IN ('student', 'teacher', 'admin')) DEFAULT 'student',
-        login TEXT,
-        password TEXT,
-        is_approved BOOLEAN DEFAULT 0
-    )''')
-    
-    # Изображения (для вопросов и новостей)
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        data BLOB NOT NULL,
-        mime_type TEXT NOT NULL
-    )''')
-    
-    # Тесты
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS tests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        creator_id INTEGER NOT NULL,
-        grading_system TEXT NOT NULL,  -- JSON: {"A": 90, "B": 80, ...}
-        is_open BOOLEAN DEFAULT 1,
-        FOREIGN KEY (creator_id) REFERENCES users(id)
-    )''')
-    
-    # Олимпиады
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS olympiads (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        creator_id INTEGER NOT NULL,
-        grading_system TEXT NOT NULL,  -- JSON
-        start_time DATETIME NOT NULL,
-        end_time DATETIME NOT NULL,
-        duration INTEGER NOT NULL,  -- в минутах
-        FOREIGN KEY (creator_id) REFERENCES users(id)
-    )''')
-    
-    # Вопросы (общие для тестов и олимпиад)
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS questions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        content TEXT NOT NULL,
-        type TEXT CHECK(type IN ('single', 'multiple', 'text')) NOT NULL,
-        points INTEGER NOT NULL,
-        image_id INTEGER,
-        FOREIGN KEY (image_id) REFERENCES images(id)
-    )''')
-    
-    # Варианты ответов
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS answers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        question_id INTEGER NOT NULL,
-        content TEXT NOT NULL,
-        is_correct BOOLEAN NOT NULL,
-        FOREIGN KEY (question_id) REFERENCES questions(id)
-    )''')
-    
-    # Связь тестов с вопросами
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS test_questions (
-        test_id INTEGER NOT NULL,
-        question_id INTEGER NOT NULL,
-        PRIMARY KEY (test_id, question_id),
-        FOREIGN KEY (test_id) REFERENCES tests(id),
-        FOREIGN KEY (question_id) REFERENCES questions(id)
-    )''')
-    
-    # Связь олимпиад с вопросами
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS olympiad_questions (
-        olympiad_id INTEGER NOT NULL,
-        question_id INTEGER NOT NULL,
-        PRIMARY KEY (olympiad_id, question_id),
-        FOREIGN KEY (olympiad_id) REFERENCES olympiads(id),
-        FOREIGN KEY (question_id) REFERENCES questions(id)
-    )''')
-    
-    # Результаты тестов
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS test_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        test_id INTEGER NOT NULL,
-        start_time DATETIME NOT NULL,
-        end_time DATETIME NOT NULL,
-        score INTEGER NOT NULL,
-        total_score INTEGER NOT NULL,
-        grade TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (test_id) REFERENCES tests(id)
-    )''')
-    
-    # Результаты олимпиад
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS olympiad_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        olympiad_id INTEGER NOT NULL,
-        start_time DATETIME NOT NULL,
-        end_time DATETIME NOT NULL,
-        score INTEGER DEFAULT 0,
-        total_score INTEGER NOT NULL,
-        grade TEXT,
-        is_checked BOOLEAN DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (olympiad_id) REFERENCES olympiads(id)
-    )''')
-    
-    # Ответы пользователей
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS user_answers (
-        result_id INTEGER NOT NULL,  -- ID из test_results или olympiad_results
-        question_id INTEGER NOT NULL,
-        answer_ids TEXT,  -- JSON-массив ID для выбора
-        answer_text TEXT,  -- для текстовых ответов
-        is_olympiad BOOLEAN NOT NULL,  -- 0=test, 1=olympiad
-        PRIMARY KEY (result_id, question_id, is_olympiad)
-    )''')
-    
-    # Новости
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS news (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        content TEXT NOT NULL,  -- Markdown
-        author_id INTEGER NOT NULL,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        is_published BOOLEAN DEFAULT 0,
-        image_id INTEGER,
-        FOREIGN KEY (author_id) REFERENCES users(id),
-        FOREIGN KEY (image_id) REFERENCES images(id)
-    )''')
-    
-    # Избранное
-    SQL_request('''
-    CREATE TABLE IF NOT EXISTS favorites (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Добавлен суррогатный ключ
-        user_id INTEGER NOT NULL,
-        test_id INTEGER,
-        olympiad_id INTEGER,
-        CHECK (test_id IS NOT NULL OR olympiad_id IS NOT NULL),
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (test_id) REFERENCES tests(id),
-        FOREIGN KEY (olympiad_id) REFERENCES olympiads(id)
-    )''')
-    
-    # Добавляем уникальные индексы
-    SQL_request('''
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_fav_user_test 
-    ON favorites(user_id, test_id) 
-    WHERE test_id IS NOT NULL
-    ''')
-    
-    SQL_request('''
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_fav_user_olympiad 
-    ON favorites(user_id, olympiad_id) 
-    WHERE olympiad_id IS NOT NULL
-    ''')
+# === Загрузка вопросов вместе с вариантами ответов ===
+# Таблица связи и колонка идентификатора для каждого вида квиза
+QUIZ_TABLES = {
+    'olympiad': ('olympiad_questions', 'olympiad_id'),
+    'test': ('test_questions', 'test_id'),
+}
+
+
+def load_quiz_answers(kind, quiz_id, only_correct=False):
+    """
+    Загружает варианты ответов всех вопросов квиза одним запросом.
+
+    Возвращает словарь question_id -> список ответов (id, content, is_correct).
+    """
+    link_table, link_column = QUIZ_TABLES[kind]
+    answers = SQL_request(f'''
+        SELECT a.question_id, a.id, a.content, a.is_correct
+        FROM answers a
+        JOIN {link_table} l ON a.question_id = l.question_id
+        WHERE l.{link_column} = ? {"AND a.is_correct = 1" if only_correct else ""}
+        ORDER BY a.id
+    ''', (quiz_id,), fetch="all")
+
+    grouped = {}
+    for answer in answers:
+        grouped.setdefault(answer.pop('question_id'), []).append(answer)
+    return grouped
+
+
+def load_quiz_questions(kind, quiz_id, with_answers=True):
+    """
+    Загружает вопросы квиза ('olympiad' или 'test') в порядке добавления.
+
+    При with_answers=True к каждому вопросу добавляется список answers,
+    всего два запроса вне зависимости от числа вопросов.
+    """
+    link_table, link_column = QUIZ_TABLES[kind]
+    questions = SQL_request(f'''
+        SELECT q.id, q.content, q.type, q.points, q.image_id, q.image_hash
+        FROM questions q
+        JOIN {link_table} l ON q.id = l.question_id
+        WHERE l.{link_column} = ?
+        ORDER BY l.rowid
+    ''', (quiz_id,), fetch="all")
+
+    if with_answers and questions:
+        answers = load_quiz_answers(kind, quiz_id)
+        for question in questions:
+            question['answers'] = answers.get(question['id'], [])
+    return questions
 
 def approve_user(user_id):
     # Генерация логина и пароля
@@ -252,13 +434,11 @@ def save_image(image_data: bytes, mime_type: str) -> int:
     res = SQL_request(
         "INSERT INTO images (data, mime_type) VALUES (?, ?) RETURNING id",
         (image_data, mime_type),
-        fetch=True
+        fetch='one'
     )
-    return res[0][0]
+    return res['id']
 
 def create_test(title: str, description: str, creator_id: int, grading_system: dict):
     SQL_request(
         "INSERT INTO tests (title, description, creator_id, grading_system) VALUES (?, ?, ?, ?)",
         (title, description, creator_id, json.dumps(grading_system)))
-
-create_tables()
\ No newline at end of file
@@ -1,3 +1,7 @@
 from flask_cors import CORS
 
-cors = CORS(resources={r"/*": {"origins": "*"}}, supports_credentials=True)
\ No newline at end of file
+cors = CORS(
+    resources={r"/*": {"origins": "*"}},
+    supports_credentials=True,
+    expose_headers=["X-Next-Cursor", "Link"]
+)
\ No newline at end of file
@@ -0,0 +1,277 @@
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+from database import SQL_request, db_datetime, json_loads, QUIZ_TABLES, load_quiz_questions, load_quiz_answers
+from cache import LRUCache
+
+ANSWER_KEY_CACHE_SIZE = int(os.getenv("ANSWER_KEY_CACHE_SIZE", "256"))
+
+# Таблица квиза, в которой хранится система оценивания
+QUIZ_GRADING_TABLES = {
+    'olympiad': 'olympiads',
+    'test': 'tests',
+}
+
+# Скомпилированный ключ одного вопроса
+QuestionKey = namedtuple('QuestionKey', ['type', 'points', 'correct_ids', 'correct_texts'])
+# Ответ пользователя на один вопрос в разобранном виде
+UserAnswer = namedtuple('UserAnswer', ['question_id', 'answer_ids', 'answer_id_set', 'answer_text', 'normalized_text'])
+
+
+def normalize_string(text):
+    if text is None:
+        return ""
+    text = str(text).lower()
+    text = re.sub(r'[^\w]', '', text)
+    return text
+
+
+def parse_answer_ids(answer_ids):
+    """Разбирает answer_ids из user_answers (JSON-массив) в список целых чисел."""
+    if not answer_ids:
+        return []
+    if isinstance(answer_ids, str):
+        answer_ids = json_loads(answer_ids)
+    if not isinstance(answer_ids, list):
+        answer_ids = [answer_ids]
+    return [int(answer_id) for answer_id in answer_ids if answer_id is not None]
+
+
+def compute_grade(grading_system, percentage):
+    if isinstance(grading_system, str):
+        grading_system = json_loads(grading_system)
+    for g_grade, g_percent in sorted(grading_system.items(), key=lambda x: x[1], reverse=True):
+        if percentage >= g_percent:
+            return g_grade
+    return None
+
+
+class AttemptState:
+    """
+    Ответы одной попытки, проиндексированные по question_id.
+
+    Строится один раз из строк user_answers и используется проверкой,
+    прогрессом и просмотром результатов вместо линейного поиска.
+    """
+
+    def __init__(self, user_answers=()):
+        self.answers = {}
+        for row in user_answers:
+            answer_ids = parse_answer_ids(row['answer_ids'])
+            self.answers[row['question_id']] = UserAnswer(
+                question_id=row['question_id'],
+                answer_ids=answer_ids,
+                answer_id_set=frozenset(answer_ids),
+                answer_text=row['answer_text'],
+                normalized_text=normalize_string(row['answer_text']),
+            )
+
+    @classmethod
+    def load(cls, result_id, is_olympiad):
+        user_answers = SQL_request('''
+            SELECT question_id, answer_ids, answer_text
+            FROM user_answers
+            WHERE result_id = ? AND is_olympiad = ?
+        ''', (result_id, int(is_olympiad)), fetch="rows")
+        return cls(user_answers)
+
+    def get(self, question_id):
+        return self.answers.get(question_id)
+
+    def __len__(self):
+        return len(self.answers)
+
+
+class AnswerKey:
+    """
+    Ключ ответов олимпиады или теста, подготовленный для проверки в памяти.
+
+    questions: question_id -> QuestionKey с frozenset правильных id
+    и нормализованными текстовыми ответами.
+    """
+
+    def __init__(self, kind, quiz_id, fingerprint, questions, grading_system):
+        self.kind = kind
+        self.quiz_id = quiz_id
+        self.fingerprint = fingerprint
+        self.questions = questions
+        self.grading_system = grading_system
+        self.total_score = sum(q.points for q in questions.values())
+
+    def score(self, attempt):
+        """Подсчитывает баллы попытки (AttemptState или строки user_answers)."""
+        if not isinstance(attempt, AttemptState):
+            attempt = AttemptState(attempt)
+
+        score = 0
+        for question_id, question in self.questions.items():
+            user_answer = attempt.get(question_id)
+            if user_answer is None:
+                continue
+
+            if question.type == 'text':
+                if user_answer.normalized_text in question.correct_texts:
+                    score += question.points
+
+            elif question.type == 'single':
+                if user_answer.answer_ids and question.correct_ids == {user_answer.answer_ids[0]}:
+                    score += question.points
+
+            elif question.type == 'multiple':
+                if user_answer.answer_id_set == question.correct_ids:
+                    score += question.points
+        return score
+
+    def grade(self, score, total_score=None):
+        """Возвращает (процент, оценка) для набранных баллов."""
+        total_score = self.total_score if total_score is None else total_score
+        percentage = (score / total_score) * 100 if total_score else 0
+        return percentage, compute_grade(self.grading_system, percentage)
+
+
+_answer_keys = LRUCache(maxsize=ANSWER_KEY_CACHE_SIZE)
+
+
+def _fingerprint(kind, quiz_id):
+    # Вопросы только добавляются, поэтому число и последний id вопроса
+    # позволяют заметить изменения, сделанные другим воркером
+    link_table, link_column = QUIZ_TABLES[kind]
+    row = SQL_request(f'''
+        SELECT COUNT(*) AS total, MAX(question_id) AS last_id
+        FROM {link_table}
+        WHERE {link_column} = ?
+    ''', (quiz_id,), fetch="one")
+    return (row['total'], row['last_id'])
+
+
+def compile_answer_key(kind, quiz_id, fingerprint=None):
+    quiz = SQL_request(
+        f"SELECT grading_system FROM {QUIZ_GRADING_TABLES[kind]} WHERE id = ?",
+        (quiz_id,),
+        fetch="one"
+    )
+    if quiz is None:
+        return None
+
+    correct_answers = load_quiz_answers(kind, quiz_id, only_correct=True)
+    questions = {}
+    for question in load_quiz_questions(kind, quiz_id, with_answers=False):
+        correct = correct_answers.get(question['id'], [])
+        questions[question['id']] = QuestionKey(
+            type=question['type'],
+            points=question['points'],
+            correct_ids=frozenset(answer['id'] for answer in correct),
+            correct_texts=frozenset(normalize_string(answer['content']) for answer in correct),
+        )
+
+    if fingerprint is None:
+        fingerprint = _fingerprint(kind, quiz_id)
+    return AnswerKey(kind, quiz_id, fingerprint, questions, quiz['grading_system'])
+
+
+def get_answer_key(kind, quiz_id):
+    """Возвращает ключ ответов из кэша воркера, пересобирая его при изменении квиза."""
+    fingerprint = _fingerprint(kind, quiz_id)
+    key = _answer_keys.get((kind, quiz_id))
+    if key is not None and key.fingerprint == fingerprint:
+        return key
+
+    key = compile_answer_key(kind, quiz_id, fingerprint)
+    if key is not None:
+        _answer_keys.set((kind, quiz_id), key)
+    return key
+
+
+def invalidate_answer_key(kind, quiz_id):
+    _answer_keys.pop((kind, quiz_id))
+
+
+def answer_key_stats():
+    return _answer_keys.stats()
+
+
+def active_attempts():
+    """Число идущих попыток по олимпиадам: начаты, не завершены и не проверены."""
+    # Без подсказки планировщик обходит весь индекс по olympiad_id ради GROUP BY
+    rows = SQL_request(
+        "SELECT olympiad_id, COUNT(*) AS attempts FROM olympiad_results INDEXED BY idx_olympiad_results_active "
+        "WHERE is_checked = 0 AND end_time > ? GROUP BY olympiad_id",
+        (db_datetime(datetime.utcnow()),),
+        fetch="all"
+    )
+    return {row['olympiad_id']: row['attempts'] for row in rows}
+
+
+def grade_olympiad(olympiad_id, force=False):
+    """
+    Проверяет все завершившиеся попытки олимпиады разом.
+
+    Идущие попытки (end_time ещё не наступил) пропускаются и считаются
+    в сводке как active; с force=True они закрываются текущим временем.
+    Попытки, уже проверенные преподавателем (is_checked = 1), не трогаем.
+    Возвращает сводку или None, если олимпиада не найдена.
+    """
+    answer_key = get_answer_key('olympiad', olympiad_id)
+    if answer_key is None:
+        return None
+
+    results = SQL_request('''
+        SELECT id, end_time
+        FROM olympiad_results
+        WHERE olympiad_id = ? AND is_checked = 0
+    ''', (olympiad_id,), fetch="all")
+
+    user_answers = SQL_request('''
+        SELECT ua.result_id, ua.question_id, ua.answer_ids, ua.answer_text
+        FROM user_answers ua
+        JOIN olympiad_results r ON r.id = ua.result_id
+        WHERE r.olympiad_id = ? AND r.is_checked = 0 AND ua.is_olympiad = 1
+    ''', (olympiad_id,), fetch="rows")
+
+    answers_by_result = {}
+    for user_answer in user_answers:
+        answers_by_result.setdefault(user_answer['result_id'], []).append(user_answer)
+    empty_attempt = AttemptState()
+
+    now = datetime.utcnow()
+    updates = []
+    total = 0
+    active = 0
+    skipped = 0
+    for result in results:
+        end_time = result['end_time']
+        try:
+            running = not end_time or datetime.fromisoformat(end_time) > now
+        except ValueError:
+            # Одна испорченная строка не должна срывать проверку остальных
+            print(f"Попытка {result['id']} олимпиады {olympiad_id} пропущена: неверный end_time {end_time!r}")
+            skipped += 1
+            continue
+        if running:
+            if not force:
+                active += 1
+                continue
+            # Принудительное закрытие: идущую попытку завершаем текущим временем
+            end_time = db_datetime(now)
+
+        rows = answers_by_result.get(result['id'])
+        score = answer_key.score(AttemptState(rows) if rows else empty_attempt)
+        _, grade = answer_key.grade(score)
+        total += score
+        updates.append((score, answer_key.total_score, grade, end_time, result['id']))
+
+    SQL_request('''
+        UPDATE olympiad_results
+        SET score = ?, total_score = ?, grade = ?, end_time = ?
+        WHERE id = ?
+    ''', updates, fetch="many")
+
+    return {
+        "olympiad_id": olympiad_id,
+        "graded": len(updates),
+        "active": active,
+        "skipped": skipped,
+        "total_score": answer_key.total_score,
+        "average_score": round(total / len(updates), 2) if updates else 0
+    }
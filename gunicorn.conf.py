@@ -1,10 +1,26 @@
+import multiprocessing
 import os
+import tempfile
 
 bind = f"0.0.0.0:{os.getenv('CONTAINER_PORT', '5000')}"
-workers = 4
-worker_class = "sync"
-timeout = 30
-keepalive = 2
+
+# Режим воркеров: gevent — тысячи одновременных соединений на воркер
+# (SQLite, bcrypt и Pillow выполняются в пуле потоков, журнал аудита пишет
+# отдельный поток ОС, см. concurrency.py);
+# sync / gthread — по одному / нескольку запросов на воркер
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+cpu_count = multiprocessing.cpu_count()
+if worker_class == "gevent":
+    # Воркер gevent не простаивает на вводе-выводе: достаточно одного на ядро
+    workers = int(os.getenv("GUNICORN_WORKERS", str(cpu_count)))
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "2000"))
+else:
+    workers = int(os.getenv("GUNICORN_WORKERS", str(cpu_count * 2 + 1)))
+    threads = int(os.getenv("GUNICORN_THREADS", "4" if worker_class == "gthread" else "1"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+# Участники олимпиады шлют ответы по одному соединению
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5" if worker_class == "gevent" else "2"))
 
 # Логирование
 accesslog = "-"
@@ -20,4 +36,42 @@ raw_env = [
     "FLASK_ENV=production",
 ]
 
-reload = False
\ No newline at end of file
+reload = False
+
+# Пул bcrypt (hashing.py) — на хост, а не на воркер: ядра делятся между
+# воркерами, но у каждого воркера хотя бы один процесс (bcrypt не в воркере)
+os.environ.setdefault("HASH_POOL_SIZE", str(max(1, cpu_count // workers)))
+
+# Снимки метрик воркеров для /metrics (см. metrics.py); задаётся до импорта приложения
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "olympiad-metrics"))
+
+
+def on_starting(server):
+    # Миграции схемы выполняются один раз в мастере, до запуска воркеров
+    from migrations import migrate
+    migrate()
+    # Счётчики прошлого запуска сервера не должны попасть в новые
+    from metrics import reset_metrics_dir
+    reset_metrics_dir()
+
+
+def post_worker_init(worker):
+    # Воркер только сверяет версию схемы (миграции уже выполнил on_starting).
+    # Не в create_app: импорт приложения командами flask не должен трогать БД
+    from migrations import check_schema
+    check_schema()
+    # Очередь писем разбирается с запуска воркера, а не с первого send_email
+    from mail import start_mail_worker
+    start_mail_worker()
+
+
+def worker_exit(server, worker):
+    # Соединения с SQLite закрываются явно, а не при уничтожении процесса
+    from database import close_all_connections
+    close_all_connections()
+
+
+def child_exit(server, worker):
+    # Счётчики завершившегося воркера переносятся в общий архив
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from concurrency import gevent_active, map_blocking
+
+# Стоимость bcrypt (log2 числа раундов)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Число процессов для хеширования на процесс; 0 — хешировать в самом воркере.
+# Под gunicorn по умолчанию ядра делятся между воркерами (см. gunicorn.conf.py)
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(os.cpu_count() or 1)))
+# Массовое хеширование в одном запросе: порции и бюджет времени (с),
+# заметно меньше таймаута gunicorn (GUNICORN_TIMEOUT)
+HASH_BULK_CHUNK = int(os.getenv("HASH_BULK_CHUNK", "16"))
+HASH_BULK_BUDGET = float(os.getenv("HASH_BULK_BUDGET", "20"))
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class HashingService:
+    """
+    Выполняет bcrypt вне воркера gunicorn: в пуле процессов, а под
+    gevent — в пуле потоков (bcrypt отпускает GIL).
+
+    Пул создаётся лениво в каждом процессе (после fork), процессы пула
+    запускаются через spawn и не наследуют потоки воркера.
+    """
+
+    def __init__(self, pool_size=HASH_POOL_SIZE, rounds=BCRYPT_ROUNDS):
+        self.pool_size = pool_size
+        self.rounds = rounds
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "submitted": 0, "completed": 0, "pending": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0}
+
+    def _get_executor(self):
+        if self.pool_size <= 0:
+            return None
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.pool_size,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _track(self, count, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats["pending"] -= count
+            self.stats["calls"] += 1
+            self.stats["completed"] += count
+            self.stats["latency_ms_total"] += elapsed_ms
+            self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], elapsed_ms)
+
+    def _run(self, func, args_list):
+        with self._lock:
+            self.stats["submitted"] += len(args_list)
+            self.stats["pending"] += len(args_list)
+        started = time.perf_counter()
+        try:
+            # Под gevent bcrypt выполняется в потоках (он отпускает GIL):
+            # пул процессов не дружит с пропатченными потоками
+            if gevent_active():
+                return map_blocking(func, args_list)
+            executor = self._get_executor()
+            if executor is None:
+                return [func(*args) for args in args_list]
+            futures = [executor.submit(func, *args) for args in args_list]
+            return [future.result() for future in futures]
+        finally:
+            self._track(len(args_list), started)
+
+    def hash_password(self, password):
+        return self._run(_hashpw, [(password, self.rounds)])[0]
+
+    def check_password(self, password, hashed):
+        return self._run(_checkpw, [(password, hashed)])[0]
+
+    def hash_many(self, passwords):
+        """Хеширует несколько паролей параллельно на всех процессах пула."""
+        return self._run(_hashpw, [(password, self.rounds) for password in passwords])
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["pool_size"] = self.pool_size
+        stats["rounds"] = self.rounds
+        stats["latency_ms_avg"] = round(stats["latency_ms_total"] / stats["calls"], 2) if stats["calls"] else 0.0
+        stats["latency_ms_total"] = round(stats["latency_ms_total"], 2)
+        stats["latency_ms_max"] = round(stats["latency_ms_max"], 2)
+        return stats
+
+
+hashing_service = HashingService()
+
+
+def hash_password(password):
+    return hashing_service.hash_password(password)
+
+
+def check_password(password, hashed):
+    return hashing_service.check_password(password, hashed)
+
+
+def hash_many(passwords):
+    return hashing_service.hash_many(passwords)
+
+
+def hashing_stats():
+    return hashing_service.get_stats()
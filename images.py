@@ -0,0 +1,297 @@
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+from collections import namedtuple
+from datetime import datetime, timezone
+from database import SQL_request, get_connection
+from concurrency import run_blocking
+from cache import LRUCache
+from config import ALLOWED_EXTENSIONS, UPLOAD_FOLDER
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow варианты (миниатюры, WebP) не создаются
+    Image = None
+
+# Каталог хранилища изображений по содержимому
+IMAGE_STORE_PATH = os.path.abspath(
+    os.getenv("IMAGE_STORE_PATH", os.path.join(UPLOAD_FOLDER or "uploads", "images"))
+)
+# Наибольшая сторона миниатюры в пикселях
+IMAGE_THUMB_SIZE = int(os.getenv("IMAGE_THUMB_SIZE", "320"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+
+IMAGE_VARIANTS = ('thumb', 'webp')
+# Типы, которые отдаются как есть; остальное — application/octet-stream,
+# чтобы загрузка с Content-Type text/html не открывалась как страница
+IMAGE_MIME_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Размер порции при потоковой отдаче BLOB
+IMAGE_CHUNK_SIZE = int(os.getenv("IMAGE_CHUNK_SIZE", str(64 * 1024)))
+# LRU горячих изображений в памяти воркера (байт)
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Изображения крупнее этого размера всегда читаются из БД порциями
+IMAGE_CACHE_MAX_ITEM_BYTES = int(os.getenv("IMAGE_CACHE_MAX_ITEM_BYTES", str(4 * 1024 * 1024)))
+
+ImageMeta = namedtuple('ImageMeta', ['id', 'mime_type', 'size', 'etag', 'last_modified'])
+
+_image_cache = LRUCache(
+    maxsize=4096,
+    maxweight=IMAGE_CACHE_BYTES,
+    weigher=lambda item: item[0].size
+)
+
+
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def detect_mime_type(data, declared=None):
+    """
+    Тип изображения по содержимому (формат, определённый Pillow), а не по
+    заголовку клиента. None — не изображение допустимого типа.
+    """
+    if Image is None:
+        # Без Pillow содержимое не проверить: доверяем только разрешённым типам
+        return declared if declared in IMAGE_MIME_TYPES else None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            mime_type = Image.MIME.get(image.format)
+    except Exception:
+        return None
+    return mime_type if mime_type in IMAGE_MIME_TYPES else None
+
+
+def safe_mime_type(mime_type):
+    """Тип для ответа: записи, сохранённые до проверки содержимого, не отдаются как HTML."""
+    return mime_type if mime_type in IMAGE_MIME_TYPES else 'application/octet-stream'
+
+
+def image_olympiad_starts(image_id):
+    """Время начала олимпиад, в вопросах которых используется изображение."""
+    rows = SQL_request('''
+        SELECT o.start_time
+        FROM questions q
+        JOIN olympiad_questions oq ON oq.question_id = q.id
+        JOIN olympiads o ON o.id = oq.olympiad_id
+        WHERE q.image_id = ?
+    ''', (image_id,), fetch="all")
+    return [row['start_time'] for row in rows]
+
+
+def get_image_meta(image_id):
+    # length() для BLOB не читает само содержимое
+    row = SQL_request('''
+        SELECT id, mime_type, length(data) AS size, created_at
+        FROM images
+        WHERE id = ?
+    ''', (image_id,), fetch="one")
+    if row is None:
+        return None
+
+    last_modified = None
+    if row['created_at']:
+        last_modified = datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    # Изображения не изменяются, поэтому id и размер — надёжный валидатор
+    return ImageMeta(row['id'], row['mime_type'], row['size'], f"img-{row['id']}-{row['size']}", last_modified)
+
+
+def _read_blob(image_id, start, length):
+    # Соединение принадлежит потоку, поэтому BLOB открывается на каждую порцию:
+    # под gevent порции читают разные потоки пула
+    blob = get_connection().blobopen('images', 'data', image_id, readonly=True)
+    try:
+        blob.seek(start)
+        return blob.read(length)
+    finally:
+        blob.close()
+
+
+def iter_image_data(image_id, start, stop):
+    """Отдаёт байты [start, stop) изображения порциями, не загружая BLOB целиком."""
+    if hasattr(sqlite3.Connection, 'blobopen'):
+        position = start
+        while position < stop:
+            chunk = run_blocking(_read_blob, image_id, position, min(IMAGE_CHUNK_SIZE, stop - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+        return
+
+    # Python < 3.11: читаем порции через substr (позиции в SQLite с 1)
+    position = start
+    while position < stop:
+        length = min(IMAGE_CHUNK_SIZE, stop - position)
+        row = SQL_request(
+            "SELECT substr(data, ?, ?) AS chunk FROM images WHERE id = ?",
+            (position + 1, length, image_id),
+            fetch="one"
+        )
+        if not row or not row['chunk']:
+            break
+        position += len(row['chunk'])
+        yield row['chunk']
+
+
+def load_image(image_id):
+    """
+    Возвращает (meta, data). data заполняется только для изображений,
+    которые помещаются в LRU; крупные отдаются потоком из БД.
+    """
+    cached = _image_cache.get(image_id)
+    if cached is not None:
+        return cached
+
+    meta = get_image_meta(image_id)
+    if meta is None:
+        return None, None
+    if meta.size > IMAGE_CACHE_MAX_ITEM_BYTES:
+        return meta, None
+
+    # Всё изображение читается одним вызовом в пуле потоков
+    data = run_blocking(lambda: b"".join(iter_image_data(image_id, 0, meta.size)))
+    _image_cache.set(image_id, (meta, data))
+    return meta, data
+
+
+def image_cache_stats():
+    return _image_cache.stats()
+
+
+# === Хранилище изображений по SHA-256 ===
+StoredImage = namedtuple('StoredImage', ['sha256', 'mime_type', 'size', 'variants', 'last_modified'])
+
+
+def image_path(sha256, variant=None):
+    filename = sha256 if variant is None else f"{sha256}.{variant}"
+    return os.path.join(IMAGE_STORE_PATH, sha256[:2], filename)
+
+
+def _write_file(path, data):
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Запись через временный файл: параллельная загрузка того же файла
+    # не увидит его наполовину записанным. Имя уникально для каждого вызова,
+    # а не только для процесса: в одном воркере пишут несколько потоков/гринлетов
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp создаёт файл с правами 0600 — возвращаем обычные права,
+        # чтобы файлы мог отдавать фронтовой сервер
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _make_variants(sha256, data):
+    """Создаёт миниатюру и WebP-версию. Возвращает (width, height, variants)."""
+    if Image is None:
+        return None, None, []
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            image_format = image.format
+
+            thumb = image.copy()
+            thumb.thumbnail((IMAGE_THUMB_SIZE, IMAGE_THUMB_SIZE))
+            buffer = io.BytesIO()
+            thumb.save(buffer, format=image_format)
+            _write_file(image_path(sha256, 'thumb'), buffer.getvalue())
+
+            buffer = io.BytesIO()
+            webp = image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+            webp.save(buffer, format='WEBP', quality=IMAGE_WEBP_QUALITY)
+            _write_file(image_path(sha256, 'webp'), buffer.getvalue())
+        return width, height, list(IMAGE_VARIANTS)
+    except Exception as e:
+        print(f"Ошибка создания вариантов изображения {sha256}: {e}")
+        return None, None, []
+
+
+def store_image(data, declared_mime_type=None):
+    """
+    Сохраняет изображение в хранилище и возвращает его SHA-256
+    (None, если файл не изображение допустимого типа).
+
+    Тип определяется по содержимому; declared_mime_type учитывается только
+    без Pillow. Одинаковые файлы хранятся один раз; варианты создаются
+    только при первой загрузке.
+    """
+    mime_type = run_blocking(detect_mime_type, data, declared_mime_type)
+    if mime_type is None:
+        return None
+    sha256 = hashlib.sha256(data).hexdigest()
+    if SQL_request("SELECT 1 FROM image_objects WHERE sha256 = ?", (sha256,), fetch="one"):
+        return sha256
+
+    # Запись файлов и Pillow держат воркер gevent — выполняются в пуле потоков
+    run_blocking(_write_file, image_path(sha256), data)
+    width, height, variants = run_blocking(_make_variants, sha256, data)
+    SQL_request('''
+        INSERT OR IGNORE INTO image_objects (sha256, mime_type, size, width, height, variants)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (sha256, mime_type, len(data), width, height, ",".join(variants)), fetch='none')
+    return sha256
+
+
+def get_stored_image(sha256):
+    if not SHA256_RE.match(sha256):
+        return None
+    row = SQL_request(
+        "SELECT sha256, mime_type, size, variants, created_at FROM image_objects WHERE sha256 = ?",
+        (sha256,),
+        fetch="one"
+    )
+    if row is None:
+        return None
+    last_modified = None
+    if row['created_at']:
+        last_modified = datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    variants = tuple(row['variants'].split(',')) if row['variants'] else ()
+    return StoredImage(row['sha256'], row['mime_type'], row['size'], variants, last_modified)
+
+
+def variant_mime_type(image, variant):
+    if variant == 'webp':
+        return 'image/webp'
+    return safe_mime_type(image.mime_type)
+
+
+def migrate_legacy_images(purge=False):
+    """
+    Переносит BLOB из таблицы images в хранилище и связывает вопросы
+    и новости по хешу. С purge=True строки images удаляются.
+    """
+    moved = 0
+    for row in SQL_request("SELECT id FROM images ORDER BY id", fetch="all"):
+        image = SQL_request("SELECT data, mime_type FROM images WHERE id = ?", (row['id'],), fetch="one")
+        sha256 = store_image(image['data'], image['mime_type'])
+        if sha256 is None:
+            print(f"Изображение {row['id']} не перенесено: содержимое не является изображением")
+            continue
+        for table in ('questions', 'news'):
+            SQL_request(
+                f"UPDATE {table} SET image_hash = ? WHERE image_id = ? AND image_hash IS NULL",
+                (sha256, row['id']),
+                fetch='none'
+            )
+            if purge:
+                SQL_request(f"UPDATE {table} SET image_id = NULL WHERE image_id = ?", (row['id'],), fetch='none')
+        if purge:
+            SQL_request("DELETE FROM images WHERE id = ?", (row['id'],), fetch='none')
+            _image_cache.pop(row['id'])
+        moved += 1
+    return moved
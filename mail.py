@@ -2,7 +2,10 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from database import SQL_request
 
 load_dotenv()
 
@@ -10,27 +13,238 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "20"))
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
 
-def send_email(to_email, subject, text_body, html_body=None):
+# === Очередь исходящей почты ===
+# Запускать ли фоновую отправку внутри воркеров API (иначе — flask mail-worker)
+MAIL_WORKER_ENABLED = os.getenv("MAIL_WORKER_ENABLED", "True").lower() in ["true", "1"]
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", "5"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "30"))
+# Через сколько секунд простоя SMTP-сессия закрывается
+MAIL_IDLE_TIMEOUT = float(os.getenv("MAIL_IDLE_TIMEOUT", "60"))
+# Письма в статусе 'sending' дольше этого срока считаются брошенными
+MAIL_CLAIM_TIMEOUT = float(os.getenv("MAIL_CLAIM_TIMEOUT", "300"))
+
+
+def build_message(to_email, subject, text_body, html_body=None):
     msg = MIMEMultipart()
     msg['From'] = FROM_EMAIL
     msg['To'] = to_email
     msg['Subject'] = subject
 
     # Добавляем текстовое тело письма
-    msg.attach(MIMEText(text_body, 'plain'))
+    msg.attach(MIMEText(text_body or '', 'plain'))
 
     # Если есть HTML версия — добавляем её
     if html_body:
         msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+
+def send_email(to_email, subject, text_body, html_body=None):
+    """
+    Ставит письмо в очередь mail_outbox и сразу возвращает управление.
+
+    Отправку выполняет фоновый воркер с постоянной SMTP-сессией.
+    """
+    try:
+        SQL_request('''
+            INSERT INTO mail_outbox (to_email, subject, text_body, html_body, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (to_email, subject, text_body, html_body, time.time()), fetch='none')
+    except Exception as e:
+        print(f"Ошибка постановки email в очередь: {e}")
+        return False
 
+    if MAIL_WORKER_ENABLED:
+        mail_worker.wake()
+    return True
+
+
+def send_email_now(to_email, subject, text_body, html_body=None):
+    """Синхронная отправка одного письма в отдельной SMTP-сессии."""
+    msg = build_message(to_email, subject, text_body, html_body)
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT) as server:
             server.starttls()
             server.login(SMTP_USER, SMTP_PASSWORD)
             server.sendmail(FROM_EMAIL, to_email, msg.as_string())
         return True
     except Exception as e:
         print(f"Ошибка отправки email: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+class SMTPSession:
+    """Одна авторизованная SMTP-сессия, переиспользуемая между письмами."""
+
+    def __init__(self):
+        self.server = None
+        self.last_used = 0.0
+        self.connections = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        server.starttls()
+        server.login(SMTP_USER, SMTP_PASSWORD)
+        self.server = server
+        self.connections += 1
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+
+    def close_if_idle(self):
+        if self.server is not None and time.monotonic() - self.last_used > MAIL_IDLE_TIMEOUT:
+            self.close()
+
+    def send(self, to_email, message):
+        if self.server is None:
+            self._connect()
+        try:
+            self.server.sendmail(FROM_EMAIL, to_email, message)
+        except smtplib.SMTPServerDisconnected:
+            # Сервер закрыл сессию: переподключаемся один раз
+            self.server = None
+            self._connect()
+            self.server.sendmail(FROM_EMAIL, to_email, message)
+        self.last_used = time.monotonic()
+
+
+class MailWorker:
+    """
+    Фоновый отправитель писем из mail_outbox.
+
+    Письма забираются пачками атомарным UPDATE ... RETURNING, поэтому
+    несколько процессов могут работать с одной очередью. Неудачные
+    отправки повторяются с экспоненциальной задержкой.
+    """
+
+    def __init__(self):
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "batches": 0}
+        self._pid = None
+        self._event = threading.Event()
+        self._start_lock = threading.Lock()
+        self.session = SMTPSession()
+
+    def wake(self):
+        self.start()
+        self._event.set()
+
+    def start(self):
+        """Запускает поток отправки в текущем процессе (повторный вызов ничего не делает)."""
+        # Поток создаётся в каждом процессе заново (после fork)
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._event = threading.Event()
+            self.session = SMTPSession()
+            thread = threading.Thread(target=self.run_forever, name="mail-worker", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def claim_batch(self):
+        now = time.time()
+        return SQL_request('''
+            UPDATE mail_outbox
+            SET status = 'sending', claimed_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM mail_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND claimed_at < ?)
+                ORDER BY id
+                LIMIT ?
+            )
+            RETURNING id, to_email, subject, text_body, html_body, attempts
+        ''', (now, now, now - MAIL_CLAIM_TIMEOUT, MAIL_BATCH_SIZE), fetch='all')
+
+    def process_batch(self):
+        """Отправляет одну пачку писем. Возвращает число обработанных писем."""
+        batch = self.claim_batch()
+        if not batch:
+            return 0
+
+        sent, retries, failed = [], [], []
+        for item in batch:
+            message = build_message(item['to_email'], item['subject'], item['text_body'], item['html_body'])
+            try:
+                self.session.send(item['to_email'], message.as_string())
+                sent.append((item['id'],))
+            except Exception as e:
+                print(f"Ошибка отправки email {item['id']}: {e}")
+                self.session.close()
+                if item['attempts'] >= MAIL_MAX_ATTEMPTS:
+                    failed.append((str(e), item['id']))
+                else:
+                    delay = MAIL_RETRY_BASE * (2 ** (item['attempts'] - 1))
+                    retries.append((time.time() + delay, str(e), item['id']))
+
+        # Тела отправленных писем удаляем: в них бывают пароли
+        if sent:
+            SQL_request('''
+                UPDATE mail_outbox
+                SET status = 'sent', sent_at = datetime('now'), text_body = NULL, html_body = NULL
+                WHERE id = ?
+            ''', sent, fetch='many')
+        if retries:
+            SQL_request('''
+                UPDATE mail_outbox SET status = 'pending', next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            ''', retries, fetch='many')
+        if failed:
+            SQL_request('''
+                UPDATE mail_outbox SET status = 'failed', last_error = ? WHERE id = ?
+            ''', failed, fetch='many')
+
+        self.stats["sent"] += len(sent)
+        self.stats["retried"] += len(retries)
+        self.stats["failed"] += len(failed)
+        self.stats["batches"] += 1
+        return len(batch)
+
+    def run_forever(self):
+        while True:
+            try:
+                while self.process_batch():
+                    pass
+                self.session.close_if_idle()
+            except Exception as e:
+                print(f"Ошибка обработки очереди писем: {e}")
+            self._event.wait(MAIL_POLL_INTERVAL)
+            self._event.clear()
+
+
+mail_worker = MailWorker()
+
+
+def start_mail_worker():
+    """
+    Запускает отправку писем при старте воркера: письма, оставшиеся в очереди
+    после перезапуска (pending и отложенные повторы), не ждут нового send_email.
+    """
+    if MAIL_WORKER_ENABLED:
+        mail_worker.start()
+
+
+def mail_stats():
+    queue = SQL_request('''
+        SELECT
+            SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) AS pending,
+            SUM(CASE WHEN status = 'sending' THEN 1 ELSE 0 END) AS sending,
+            SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) AS failed
+        FROM mail_outbox
+        WHERE status IN ('pending', 'sending', 'failed')
+    ''', fetch='one') or {}
+    return {
+        "outbox": {key: value or 0 for key, value in queue.items()},
+        "worker": dict(mail_worker.stats, smtp_connections=mail_worker.session.connections)
+    }
@@ -0,0 +1,390 @@
+"""
+Метрики в формате Prometheus (GET /metrics).
+
+Каждый воркер копит счётчики и гистограммы в памяти и раз в
+METRICS_FLUSH_INTERVAL секунд сохраняет снимок в METRICS_DIR/worker-<pid>.json.
+/metrics суммирует снимки всех воркеров, поэтому ответ не зависит от того,
+какой воркер принял запрос. Снимок завершившегося воркера мастер gunicorn
+вливает в archive.json (хук child_exit), чтобы счётчики не убывали.
+
+Без METRICS_DIR (flask run, тесты) отдаются метрики только текущего процесса.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from concurrency import native_lock
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Статический токен для Prometheus; без него /metrics доступен только администратору
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Границы корзин гистограммы длительности запросов (секунды)
+LATENCY_BUCKETS = tuple(
+    float(bound) for bound in
+    os.getenv("METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")
+)
+
+ARCHIVE_FILE = "archive.json"
+
+# Описание метрик: имя -> (тип, справка)
+METRICS = {
+    "http_requests_total": ("counter", "HTTP-запросы по маршруту, методу и статусу"),
+    "http_request_duration_seconds": ("histogram", "Длительность обработки HTTP-запроса"),
+    "http_requests_in_flight": ("gauge", "Запросы в обработке"),
+    "http_request_db_queries_total": ("counter", "SQL-запросы, выполненные при обработке маршрута"),
+    "http_request_db_seconds_total": ("counter", "Время SQL-запросов при обработке маршрута"),
+    "db_queries_total": ("counter", "Все SQL-запросы через SQL_request"),
+    "db_query_seconds_total": ("counter", "Суммарное время SQL-запросов"),
+    "db_slow_queries_total": ("counter", "SQL-запросы дольше SQL_SLOW_QUERY_MS"),
+    "db_write_lock_wait_seconds_total": ("counter", "Ожидание замка писателя SQLite"),
+    "db_write_retries_total": ("counter", "Повторы записи при занятой БД"),
+    "cache_hits_total": ("counter", "Попадания в кэши воркеров"),
+    "cache_misses_total": ("counter", "Промахи кэшей воркеров"),
+    "cache_hit_ratio": ("gauge", "Доля попаданий по всем воркерам"),
+    "blocking_pool_busy": ("gauge", "Занятые потоки пула SQLite/bcrypt (gevent)"),
+    "blocking_pool_queued": ("gauge", "Вызовы в очереди пула SQLite/bcrypt (gevent)"),
+    "hashing_pending": ("gauge", "Хеширования bcrypt в очереди пула процессов"),
+    "mail_queue_depth": ("gauge", "Письма в очереди mail_outbox по статусу"),
+    "olympiad_active_attempts": ("gauge", "Идущие попытки олимпиад"),
+    "metrics_workers": ("gauge", "Воркеры, приславшие снимок метрик"),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    """Счётчики и гистограммы одного процесса."""
+
+    def __init__(self):
+        self._lock = native_lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels, value):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Счётчики корзин без накопления, последняя — +Inf
+                histogram = self.histograms[key] = {"buckets": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            histogram["buckets"][bisect.bisect_left(buckets, value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [
+                    [name, list(labels), list(h["buckets"]), h["sum"], h["count"]]
+                    for (name, labels), h in self.histograms.items()
+                ],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+            }
+
+
+registry = Registry()
+
+
+# === Запросы ===
+
+def request_started():
+    registry.add_gauge("http_requests_in_flight", {}, 1)
+    _ensure_flusher()
+
+
+def request_finished():
+    registry.add_gauge("http_requests_in_flight", {}, -1)
+
+
+def observe_request(method, route, status, elapsed_s, sql):
+    registry.inc("http_requests_total", {"method": method, "route": route, "status": str(status)})
+    registry.observe("http_request_duration_seconds", {"method": method, "route": route}, elapsed_s)
+    if sql["count"]:
+        registry.inc("http_request_db_queries_total", {"route": route}, sql["count"])
+        registry.inc("http_request_db_seconds_total", {"route": route}, sql["time_ms"] / 1000)
+
+
+# === Статистика модулей, накопленная в процессе ===
+
+def _cache_samples(name, stats):
+    return [
+        ("cache_hits_total", {"cache": name}, stats["hits"]),
+        ("cache_misses_total", {"cache": name}, stats["misses"]),
+    ]
+
+
+def collect_process_metrics():
+    """
+    Снимает накопительную статистику модулей (кэши, БД, пулы).
+    Импорты внутри функции: эти модули сами импортируют middleware.
+    """
+    from concurrency import blocking_pool_stats
+    from database import storage_stats
+    from grading import answer_key_stats
+    from hashing import hashing_stats
+    from images import image_cache_stats
+    from middleware import auth_cache_stats
+    from payload_cache import payload_cache_stats
+    from query_stats import query_stats
+
+    sql = query_stats(top=0)
+    storage = storage_stats()
+    counters = [
+        ("db_queries_total", {}, sql["queries"]),
+        ("db_query_seconds_total", {}, sql["time_ms_total"] / 1000),
+        ("db_slow_queries_total", {}, sql["slow"]),
+        ("db_write_lock_wait_seconds_total", {}, storage["lock_wait_ms_total"] / 1000),
+        ("db_write_retries_total", {}, storage["retries"]),
+    ]
+
+    payload = payload_cache_stats()
+    payload_hits = sum(value for name, value in payload.items() if name.startswith("hits_"))
+    counters.append(("cache_hits_total", {"cache": "payload"}, payload_hits))
+    counters.append(("cache_misses_total", {"cache": "payload"}, payload["requests"] - payload_hits))
+    counters.extend(_cache_samples("answer_keys", answer_key_stats()))
+    counters.extend(_cache_samples("images", image_cache_stats()))
+    for name, stats in auth_cache_stats().items():
+        counters.extend(_cache_samples(f"auth_{name}", stats))
+
+    pool = blocking_pool_stats()
+    gauges = [
+        ("blocking_pool_busy", {}, pool.get("busy", 0)),
+        ("blocking_pool_queued", {}, pool.get("queued", 0)),
+        ("hashing_pending", {}, hashing_stats().get("pending", 0)),
+    ]
+    return counters, gauges
+
+
+def process_snapshot():
+    snapshot = registry.snapshot()
+    counters, gauges = collect_process_metrics()
+    snapshot["counters"].extend([name, list(_labels_key(labels)), value] for name, labels, value in counters)
+    snapshot["gauges"].extend([name, list(_labels_key(labels)), value] for name, labels, value in gauges)
+    snapshot["pid"] = os.getpid()
+    snapshot["written_at"] = time.time()
+    return snapshot
+
+
+# === Снимки воркеров в METRICS_DIR ===
+
+def _worker_file(pid):
+    return os.path.join(METRICS_DIR, f"worker-{pid}.json")
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """Сохраняет снимок текущего воркера (атомарно, через переименование)."""
+    if not METRICS_DIR:
+        return
+    try:
+        _write_json(_worker_file(os.getpid()), process_snapshot())
+    except OSError as e:
+        print(f"Ошибка записи метрик: {e}")
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _ensure_flusher():
+    """Запускает фоновую запись снимков в каждом воркере (после fork — заново)."""
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(flush)
+        _flusher_pid = os.getpid()
+
+
+def _merge(total, snapshot, with_gauges=True):
+    for name, labels, value in snapshot.get("counters", []):
+        key = (name, tuple(map(tuple, labels)))
+        total["counters"][key] = total["counters"].get(key, 0) + value
+    for name, labels, buckets, sum_, count in snapshot.get("histograms", []):
+        key = (name, tuple(map(tuple, labels)))
+        current = total["histograms"].get(key)
+        if current is None or len(current[0]) != len(buckets):
+            total["histograms"][key] = [list(buckets), sum_, count]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += sum_
+            current[2] += count
+    if with_gauges:
+        for name, labels, value in snapshot.get("gauges", []):
+            key = (name, tuple(map(tuple, labels)))
+            total["gauges"][key] = total["gauges"].get(key, 0) + value
+
+
+def _unpack(total):
+    return {
+        "counters": [[name, [list(pair) for pair in labels], value] for (name, labels), value in total["counters"].items()],
+        "histograms": [
+            [name, [list(pair) for pair in labels], buckets, sum_, count]
+            for (name, labels), (buckets, sum_, count) in total["histograms"].items()
+        ],
+        "gauges": [],
+    }
+
+
+def mark_process_dead(pid):
+    """
+    Вливает снимок завершившегося воркера в archive.json: счётчики
+    и гистограммы сохраняются, показатели-gauge отбрасываются.
+    Вызывается мастером gunicorn (child_exit).
+    """
+    if not METRICS_DIR:
+        return
+    snapshot = _read_json(_worker_file(pid))
+    if snapshot is None:
+        return
+    total = {"counters": {}, "histograms": {}, "gauges": {}}
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    _merge(total, _read_json(archive_path) or {})
+    _merge(total, snapshot, with_gauges=False)
+    _write_json(archive_path, _unpack(total))
+    os.remove(_worker_file(pid))
+
+
+def reset_metrics_dir():
+    """Очищает METRICS_DIR при старте сервера (вызывается из on_starting)."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for filename in os.listdir(METRICS_DIR):
+        if filename.endswith((".json", ".tmp")):
+            os.remove(os.path.join(METRICS_DIR, filename))
+
+
+def aggregate():
+    """Сумма снимков всех воркеров; свой снимок берётся свежим, а не из файла."""
+    total = {"counters": {}, "histograms": {}, "gauges": {}}
+    _merge(total, process_snapshot())
+    workers = 1
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        own_file = os.path.basename(_worker_file(os.getpid()))
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith(".json") or filename == own_file:
+                continue
+            snapshot = _read_json(os.path.join(METRICS_DIR, filename))
+            if snapshot is None:
+                continue
+            _merge(total, snapshot)
+            workers += filename.startswith("worker-")
+    total["gauges"][("metrics_workers", ())] = workers
+    return total
+
+
+# === Показатели из общей БД (одни на все воркеры) ===
+
+def collect_global_metrics():
+    from grading import active_attempts
+    from mail import mail_stats
+
+    gauges = {}
+    for status, count in mail_stats()["outbox"].items():
+        gauges[("mail_queue_depth", (("status", status),))] = count
+    attempts = active_attempts()
+    gauges[("olympiad_active_attempts", ())] = sum(attempts.values())
+    for olympiad_id, count in attempts.items():
+        gauges[("olympiad_active_attempts", (("olympiad_id", str(olympiad_id)),))] = count
+    return gauges
+
+
+# === Текстовый формат Prometheus ===
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _hit_ratios(counters):
+    hits, misses = {}, {}
+    for (name, labels), value in counters.items():
+        if name == "cache_hits_total":
+            hits[labels] = value
+        elif name == "cache_misses_total":
+            misses[labels] = value
+    return {
+        ("cache_hit_ratio", labels): round(hits[labels] / (hits[labels] + misses.get(labels, 0)), 4)
+        for labels in hits if hits[labels] + misses.get(labels, 0)
+    }
+
+
+def render_metrics():
+    total = aggregate()
+    total["gauges"].update(collect_global_metrics())
+    total["gauges"].update(_hit_ratios(total["counters"]))
+
+    samples = {}
+    for kind in ("counters", "gauges"):
+        for (name, labels), value in sorted(total[kind].items()):
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), (buckets, sum_, count) in sorted(total["histograms"].items()):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket_count in zip(list(LATENCY_BUCKETS) + ["+Inf"], buckets):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(sum_)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    output = []
+    for name in sorted(samples):
+        metric_type, help_text = METRICS.get(name, ("untyped", name))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(samples[name])
+    return "\n".join(output) + "\n"
@@ -1,12 +1,21 @@
 from functools import wraps
 import jwt
-from datetime import datetime
 import logging
-from logging.handlers import RotatingFileHandler
+import copy
 import json
 import os
+import random
+import time
+import zlib
 from flask import request, jsonify, abort, g
-from database import SQL_request
+from database import SQL_request, DatabaseBusyError
+from content_versions import get_content_version, bump_content_version
+from payload_cache import quiz_variant_for_role
+from cache import LRUCache
+from audit import setup_audit_logger, audit_stats
+from query_stats import SQL_SERVER_TIMING, request_sql_stats, server_timing
+from metrics import request_started, request_finished, observe_request
+from profiler import PROFILE_HEADER, PROFILE_SAMPLE_RATE, start_request_profile, save_request_profile
 
 # === Настройка логгера для аудита ===
 audit_logger = logging.getLogger('audit')
@@ -14,15 +23,128 @@ audit_logger.setLevel(logging.INFO)
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 
-# Проверяем, существует ли уже обработчик, чтобы не дублировать
-if not audit_logger.handlers:
-    try:
-        audit_handler = RotatingFileHandler('/var/log/olympiad/audit.log', maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8')
-    except:
-        audit_handler = RotatingFileHandler('audit.log', maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8')
-    audit_formatter = logging.Formatter('%(levelname)s [%(asctime)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    audit_handler.setFormatter(audit_formatter)
-    audit_logger.addHandler(audit_handler)
+# === Кэш проверенных токенов и пользователей ===
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+# Как часто воркер сверяет общую версию пользователей (content_versions, вид
+# users): столько секунд другой воркер может видеть устаревшую роль или подтверждение
+AUTH_USERS_VERSION_INTERVAL = float(os.getenv("AUTH_USERS_VERSION_INTERVAL", "1"))
+
+_token_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+_user_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+_computer_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+# Версия пользователей, с которой согласован _user_cache этого воркера
+_users_version = {"version": None, "checked_at": 0.0}
+
+# Записи аудита пишутся в файл фоновым потоком, запрос не ждёт диска
+setup_audit_logger(audit_logger)
+
+try:
+    import brotli
+except ImportError:  # без brotli ответы сжимаются только gzip
+    brotli = None
+
+# === Сжатие ответов ===
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css", "application/javascript"}
+
+# === Условные GET: ETag по версии содержимого ===
+# endpoint -> функция(view_args) -> (вид, id) в content_versions
+CONDITIONAL_ENDPOINTS = {
+    'api.get_olympiad': lambda args: ('olympiad', args['olympiad_id']),
+    'api.get_test': lambda args: ('test', args['test_id']),
+    'api.get_tests': lambda args: ('tests', 0),
+}
+# Ответы с вариантами для преподавателя и студента (см. payload_cache.py)
+QUIZ_VARIANT_ENDPOINTS = {'api.get_olympiad', 'api.get_test'}
+# Маршруты без auth_decorator: 304 можно вернуть до обработчика. Для
+# остальных сначала проверяется токен, а 304 отдаётся после обработчика
+PUBLIC_CONDITIONAL_ENDPOINTS = {'api.get_test', 'api.get_tests'}
+
+
+def decode_token(token):
+    """Проверяет JWT, повторно используя уже проверенные токены до их истечения."""
+    payload = _token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    ttl = AUTH_CACHE_TTL
+    if 'exp' in payload:
+        ttl = min(ttl, payload['exp'] - time.time())
+    if ttl > 0:
+        _token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+
+def _cached_row(cache, key, query, params):
+    row = cache.get(key)
+    if row is None:
+        row = SQL_request(query, params=params, fetch='one')
+        if row is None:
+            return None
+        cache.set(key, row)
+    # Глубокая копия: обработчик не должен менять и вложенный inventory
+    return copy.deepcopy(row)
+
+
+def _sync_user_cache():
+    """
+    Не чаще раза в AUTH_USERS_VERSION_INTERVAL сверяет общую версию
+    пользователей; если её поднял любой воркер, кэш пользователей сбрасывается.
+    """
+    now = time.monotonic()
+    if now - _users_version["checked_at"] < AUTH_USERS_VERSION_INTERVAL:
+        return
+    version = get_content_version('users')
+    if version != _users_version["version"]:
+        _user_cache.clear()
+    _users_version["version"] = version
+    _users_version["checked_at"] = now
+
+
+def get_cached_user(user_id):
+    _sync_user_cache()
+    return _cached_row(_user_cache, ('id', user_id), "SELECT * FROM users WHERE id = ?", (user_id,))
+
+
+def get_cached_user_by_email(email):
+    _sync_user_cache()
+    return _cached_row(_user_cache, ('email', email), "SELECT * FROM users WHERE email = ?", (email,))
+
+
+def get_cached_computer(token):
+    return _cached_row(_computer_cache, token, "SELECT * FROM computers WHERE token = ?", (token,))
+
+
+def invalidate_user(user_id=None, email=None):
+    """
+    Сбрасывает кэш пользователя после изменения профиля, подтверждения или роли.
+
+    В этом воркере запись удаляется сразу, остальные сбросят кэш, заметив
+    новую версию пользователей.
+    """
+    bump_content_version('users')
+    if user_id is not None:
+        user = _user_cache.pop(('id', user_id))
+        if user and email is None:
+            email = user.get('email')
+    if email is not None:
+        _user_cache.pop(('email', email))
+
+
+def auth_cache_stats():
+    return {
+        "tokens": _token_cache.stats(),
+        "users": _user_cache.stats(),
+        "computers": _computer_cache.stats()
+    }
+
+
+def audit_log_stats():
+    return audit_stats(audit_logger)
 
 
 def auth_decorator(role='student', check_self=True):
@@ -42,7 +164,7 @@ def auth_decorator(role='student', check_self=True):
 
             try:
                 token = auth_header.split(" ")[1]
-                payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                payload = decode_token(token)
 
                 # Проверка роли
                 if role:
@@ -57,7 +179,7 @@ def auth_decorator(role='student', check_self=True):
                         abort(403, description=f"Нет прав: требуется роль {role}")
 
                     if payload.get('user_id') == 'computer':
-                        computer = SQL_request("SELECT * FROM computers WHERE token = ?", params=(token,), fetch='one')
+                        computer = get_cached_computer(token)
                         if computer:
                             user_role = f"{user_role} {computer['id']}"
                         else:
@@ -65,7 +187,13 @@ def auth_decorator(role='student', check_self=True):
 
                     # Логирование
                     audit_logger.info(
-                        f"{payload['email']} ({user_role}) вызвал маршрут {request.path} | IP: {request.remote_addr}"
+                        f"{payload['email']} ({user_role}) вызвал маршрут {request.path} | IP: {request.remote_addr}",
+                        extra={"audit": {
+                            "email": payload['email'],
+                            "role": user_role,
+                            "path": request.path,
+                            "ip": request.remote_addr
+                        }}
                     )
 
                 # Получение данных пользователя
@@ -75,20 +203,19 @@ def auth_decorator(role='student', check_self=True):
                         abort(401, description="Неверный токен: отсутствует идентификатор пользователя")
 
                     if user_id == "computer":
-                        computer = SQL_request("SELECT * FROM computers WHERE token = ?", params=(token,), fetch='one')
-                        g.computer = computer
+                        g.computer = get_cached_computer(token)
 
                     elif user_id == "password":
                         email = payload.get("email")
                         if not email:
                             abort(404, description="Неверный токен: отсутствует почта")
-                        user = SQL_request("SELECT * FROM users WHERE email = ?", params=(email,), fetch='one')
+                        user = get_cached_user_by_email(email)
                         if not user:
                             abort(404, description="Пользователь не найден")
                         g.user = user
 
                     else: 
-                        user = SQL_request("SELECT * FROM users WHERE id = ?", params=(user_id,), fetch='one')
+                        user = get_cached_user(user_id)
                         if not user:
                             abort(404, description="Пользователь не найден")
     
@@ -109,16 +236,173 @@ def auth_decorator(role='student', check_self=True):
 
 
 # === Middleware для автоматической проверки API-ключа и логирования ===
+def _token_role():
+    parts = request.headers.get('Authorization', '').split(" ")
+    if len(parts) != 2:
+        return None
+    try:
+        return decode_token(parts[1]).get('role')
+    except jwt.PyJWTError:
+        return None
+
+
+def quiz_payload_variant():
+    """Вариант ответа квиза для текущего запроса: по g.user, а до авторизации — по токену."""
+    user = g.get('user')
+    return quiz_variant_for_role(user['role'] if user else _token_role())
+
+
+def _content_etag(variant=None):
+    resolve = CONDITIONAL_ENDPOINTS.get(request.endpoint)
+    if resolve is None or request.method != 'GET':
+        return None
+    kind, content_id = resolve(request.view_args or {})
+    current = g.get('content_version')
+    # Версию мог уже прочитать кэш собранных ответов (payload_cache.py):
+    # ETag должен соответствовать версии, из которой собран ответ
+    if current is None or current[:2] != (kind, content_id):
+        g.content_version = (kind, content_id, get_content_version(kind, content_id))
+    kind, content_id, version = g.content_version
+    etag = f"{kind}-{content_id}-v{version}"
+    if request.endpoint in QUIZ_VARIANT_ENDPOINTS:
+        etag = f"{etag}-{variant or quiz_payload_variant()}"
+    return etag
+
+
+def _compressor(encoding):
+    """Возвращает (compress, flush) для потокового сжатия."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # 31 — формат gzip
+    return compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, encoding):
+    compress, flush = _compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # Длинные списки отдаются потоком — сжимаем по частям
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        compress, flush = _compressor(encoding)
+        response.set_data(compress(data) + flush())
+
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 def setup_middleware(app):
     @app.before_request
     def api_key_and_logging_middleware():
+        # Монотонные часы: время запроса не зависит от перевода системных
+        request._start_time = time.perf_counter()
+        g.metrics_in_flight = True
+        request_started()
+        return None
 
-        request._start_time = datetime.now()
+    @app.teardown_request
+    def metrics_teardown(exc):
+        if g.pop('metrics_in_flight', False):
+            request_finished()
+
+    @app.before_request
+    def start_profiling():
+        # Профиль по заголовку — только для администратора, иначе — случайная выборка
+        requested = request.headers.get(PROFILE_HEADER) == '1' and _token_role() == 'admin'
+        if requested or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            g.profiler = start_request_profile()
+            g.profile_requested = requested
         return None
 
+    @app.after_request
+    def save_profile(response):
+        sampler = g.pop('profiler', None)
+        if sampler is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            filename = save_request_profile(sampler, request.method, route)
+            if filename and g.get('profile_requested'):
+                response.headers['X-Profile-File'] = filename
+        return response
+
+    @app.teardown_request
+    def stop_profiling(exc):
+        # Запрос завершился исключением до after_request
+        sampler = g.pop('profiler', None)
+        if sampler is not None:
+            sampler.stop()
+
+    @app.before_request
+    def conditional_get():
+        # Версия читается одним запросом по ключу; если у клиента актуальная
+        # копия, отвечаем 304, не собирая дерево вопросов
+        if request.endpoint not in PUBLIC_CONDITIONAL_ENDPOINTS:
+            return None
+        etag = _content_etag()
+        if etag is None:
+            return None
+        if request.if_none_match.contains_weak(etag):
+            return app.response_class(status=304)
+        return None
+
+    @app.after_request
+    def etag_and_compression(response):
+        # Вариант берём тот, что фактически отдал обработчик
+        etag = _content_etag(g.get('payload_variant')) if response.status_code in (200, 304) else None
+        if etag:
+            response.set_etag(etag, weak=True)
+            # Клиент хранит копию, но каждый раз сверяет версию
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Authorization')
+            # Маршруты с авторизацией: 304 только после проверки токена обработчиком
+            if response.status_code == 200:
+                response.make_conditional(request)
+        return compress_response(response)
+
+    @app.errorhandler(DatabaseBusyError)
+    def database_busy(error):
+        # Запись не уложилась в DB_WRITE_DEADLINE_MS и маршрут не обработал её сам
+        logging.warning(f"{request.method} {request.path}: {error}")
+        return jsonify({"error": "База данных занята, повторите запрос позже"}), 503, {"Retry-After": "1"}
+
+    @app.after_request
+    def sql_server_timing(response):
+        # Время БД видно в DevTools браузера и в нагрузочном прогоне (bench/)
+        if SQL_SERVER_TIMING:
+            response.headers.add('Server-Timing', server_timing(request_sql_stats()))
+        return response
+
     @app.after_request
     def log_request_info(response):
         if hasattr(request, '_start_time'):
-            elapsed = (datetime.now() - request._start_time).total_seconds() * 1000  # в мс
-            logging.info(f"{request.remote_addr} {request.method} {request.path} → {response.status} за {int(elapsed)}ms")
+            elapsed = (time.perf_counter() - request._start_time) * 1000  # в мс
+            sql = request_sql_stats()
+            # Шаблон маршрута, а не путь: число серий метрик не растёт с id
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe_request(request.method, route, response.status_code, elapsed / 1000, sql)
+            logging.info(
+                f"{request.remote_addr} {request.method} {request.path} → {response.status} за {int(elapsed)}ms "
+                f"(SQL: {sql['count']} за {sql['time_ms']:.1f}ms, самый долгий {sql['slowest_ms']:.1f}ms)"
+            )
         return response
\ No newline at end of file
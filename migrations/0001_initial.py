@@ -0,0 +1,201 @@
+"""Исходная схема: таблицы, которые раньше создавал create_tables()."""
+from migrations import add_column_if_missing
+
+
+def upgrade(conn):
+    # Пользователи
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        patronymic TEXT,
+        email TEXT UNIQUE NOT NULL,
+        phone TEXT NOT NULL,
+        school TEXT NOT NULL,
+        role TEXT CHECK(role IN ('student', 'teacher', 'admin')) DEFAULT 'student',
+        login TEXT,
+        password TEXT,
+        is_approved BOOLEAN DEFAULT 0
+    )''')
+    
+    # Изображения (для вопросов и новостей)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data BLOB NOT NULL,
+        mime_type TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # В базах, созданных до появления колонки, время загрузки неизвестно
+    add_column_if_missing(conn, 'images', 'created_at', 'DATETIME')
+    
+    # Хранилище изображений по содержимому: файлы лежат на диске,
+    # в БД только метаданные (см. images.py)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS image_objects (
+        sha256 TEXT PRIMARY KEY,
+        mime_type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        width INTEGER,
+        height INTEGER,
+        variants TEXT,  -- через запятую: thumb, webp
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Тесты
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        creator_id INTEGER NOT NULL,
+        grading_system TEXT NOT NULL,  -- JSON: {"A": 90, "B": 80, ...}
+        is_open BOOLEAN DEFAULT 1,
+        FOREIGN KEY (creator_id) REFERENCES users(id)
+    )''')
+    
+    # Олимпиады
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS olympiads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        creator_id INTEGER NOT NULL,
+        grading_system TEXT NOT NULL,  -- JSON
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        duration INTEGER NOT NULL,  -- в минутах
+        FOREIGN KEY (creator_id) REFERENCES users(id)
+    )''')
+    
+    # Вопросы (общие для тестов и олимпиад)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT NOT NULL,
+        type TEXT CHECK(type IN ('single', 'multiple', 'text')) NOT NULL,
+        points INTEGER NOT NULL,
+        image_id INTEGER,
+        image_hash TEXT,  -- SHA-256 изображения в хранилище (image_objects)
+        FOREIGN KEY (image_id) REFERENCES images(id)
+    )''')
+    add_column_if_missing(conn, 'questions', 'image_hash', 'TEXT')
+    
+    # Варианты ответов
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS answers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        is_correct BOOLEAN NOT NULL,
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    )''')
+    
+    # Связь тестов с вопросами
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS test_questions (
+        test_id INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        PRIMARY KEY (test_id, question_id),
+        FOREIGN KEY (test_id) REFERENCES tests(id),
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    )''')
+    
+    # Связь олимпиад с вопросами
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS olympiad_questions (
+        olympiad_id INTEGER NOT NULL,
+        question_id INTEGER NOT NULL,
+        PRIMARY KEY (olympiad_id, question_id),
+        FOREIGN KEY (olympiad_id) REFERENCES olympiads(id),
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    )''')
+    
+    # Результаты тестов
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS test_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        test_id INTEGER NOT NULL,
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        score INTEGER NOT NULL,
+        total_score INTEGER NOT NULL,
+        grade TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (test_id) REFERENCES tests(id)
+    )''')
+    
+    # Результаты олимпиад
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS olympiad_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        olympiad_id INTEGER NOT NULL,
+        start_time DATETIME NOT NULL,
+        end_time DATETIME NOT NULL,
+        score INTEGER DEFAULT 0,
+        total_score INTEGER NOT NULL,
+        grade TEXT,
+        is_checked BOOLEAN DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (olympiad_id) REFERENCES olympiads(id)
+    )''')
+    
+    # Ответы пользователей
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_answers (
+        result_id INTEGER NOT NULL,  -- ID из test_results или olympiad_results
+        question_id INTEGER NOT NULL,
+        answer_ids TEXT,  -- JSON-массив ID для выбора
+        answer_text TEXT,  -- для текстовых ответов
+        is_olympiad BOOLEAN NOT NULL,  -- 0=test, 1=olympiad
+        PRIMARY KEY (result_id, question_id, is_olympiad)
+    )''')
+    
+    # Новости
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS news (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,  -- Markdown
+        author_id INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_published BOOLEAN DEFAULT 0,
+        image_id INTEGER,
+        image_hash TEXT,
+        FOREIGN KEY (author_id) REFERENCES users(id),
+        FOREIGN KEY (image_id) REFERENCES images(id)
+    )''')
+    add_column_if_missing(conn, 'news', 'image_hash', 'TEXT')
+    
+    # Избранное
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS favorites (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Добавлен суррогатный ключ
+        user_id INTEGER NOT NULL,
+        test_id INTEGER,
+        olympiad_id INTEGER,
+        CHECK (test_id IS NOT NULL OR olympiad_id IS NOT NULL),
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (test_id) REFERENCES tests(id),
+        FOREIGN KEY (olympiad_id) REFERENCES olympiads(id)
+    )''')
+
+    # Исходящая почта: письма отправляет фоновый воркер (см. mail.py)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS mail_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        to_email TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        text_body TEXT,
+        html_body TEXT,
+        status TEXT CHECK(status IN ('pending', 'sending', 'sent', 'failed')) DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL NOT NULL,  -- unix time
+        claimed_at REAL,
+        last_error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        sent_at DATETIME
+    )''')
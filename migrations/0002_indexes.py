@@ -0,0 +1,35 @@
+"""Вторичные индексы для горячих запросов (проверка: flask check-query-plans)."""
+
+# (имя, таблица и колонки [WHERE ...], уникальный)
+INDEXES = [
+    # Избранное: одна запись на тест / олимпиаду
+    ("idx_fav_user_test", "favorites(user_id, test_id) WHERE test_id IS NOT NULL", True),
+    ("idx_fav_user_olympiad", "favorites(user_id, olympiad_id) WHERE olympiad_id IS NOT NULL", True),
+    # Вход по логину
+    ("idx_users_login", "users(login)", False),
+    # Фильтры списка пользователей
+    ("idx_users_role", "users(role, id)", False),
+    ("idx_users_school", "users(school, id)", False),
+    # Открытые тесты
+    ("idx_tests_open", "tests(is_open)", False),
+    # Попытки пользователя и их история
+    ("idx_olympiad_results_user", "olympiad_results(user_id, olympiad_id)", False),
+    ("idx_olympiad_results_user_end", "olympiad_results(user_id, end_time, id)", False),
+    ("idx_olympiad_results_olympiad", "olympiad_results(olympiad_id, is_checked)", False),
+    ("idx_test_results_user", "test_results(user_id, test_id, end_time)", False),
+    ("idx_test_results_user_end", "test_results(user_id, end_time, id)", False),
+    # Варианты ответов вопроса и ключ проверки
+    ("idx_answers_question", "answers(question_id, is_correct)", False),
+    # Обратный поиск квизов по вопросу
+    ("idx_test_questions_question", "test_questions(question_id)", False),
+    ("idx_olympiad_questions_question", "olympiad_questions(question_id)", False),
+    # Очередь писем
+    ("idx_mail_outbox_status", "mail_outbox(status, next_attempt_at)", False),
+]
+
+
+def upgrade(conn):
+    for name, target, unique in INDEXES:
+        conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {target}")
+    # Статистика для планировщика по новым индексам
+    conn.execute("ANALYZE")
@@ -0,0 +1,40 @@
+"""Таблицы, на которые уже ссылаются middleware.py и utils.py."""
+from migrations import add_column_if_missing
+
+
+def upgrade(conn):
+    # Компьютеры (вход по токену устройства, см. auth_decorator)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS computers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        token TEXT UNIQUE NOT NULL,
+        name TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    # Коды подтверждения email
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS verification_codes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL,
+        code TEXT NOT NULL,
+        type TEXT NOT NULL,  -- register, ...
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verification_codes_email ON verification_codes(email, type)")
+
+    # Покупки и баланс пользователя (buy_products)
+    add_column_if_missing(conn, 'users', 'balance', 'REAL DEFAULT 0')
+    add_column_if_missing(conn, 'users', 'inventory', "TEXT DEFAULT '{}'")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS purchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quality INTEGER NOT NULL,  -- количество
+        price REAL NOT NULL,
+        time_buy DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases(user_id)")
@@ -0,0 +1,12 @@
+"""Версии содержимого квизов и списков для ETag и кэша ответов."""
+
+
+def upgrade(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS content_versions (
+        kind TEXT NOT NULL,  -- olympiad, test, tests (список)
+        content_id INTEGER NOT NULL,  -- 0 для списков
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (kind, content_id)
+    ) WITHOUT ROWID''')
@@ -0,0 +1,8 @@
+"""Индекс незавершённых попыток олимпиад для метрики активных участников (/metrics)."""
+
+
+def upgrade(conn):
+    # Частичный индекс: проверенные попытки (подавляющее большинство) в него не входят
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_olympiad_results_active
+    ON olympiad_results(end_time, olympiad_id) WHERE is_checked = 0''')
@@ -0,0 +1,7 @@
+"""Единый формат дат попыток: начатые олимпиады записывали ISO с 'T', завершённые — datetime('now')."""
+
+
+def upgrade(conn):
+    # datetime() приводит '2024-05-01T10:00:00.123456' к '2024-05-01 10:00:00'
+    for column in ('start_time', 'end_time'):
+        conn.execute(f"UPDATE olympiad_results SET {column} = datetime({column}) WHERE {column} LIKE '%T%'")
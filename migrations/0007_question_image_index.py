@@ -0,0 +1,7 @@
+"""Индекс вопросов по изображению: проверка доступа к /images/<id> по олимпиаде вопроса."""
+
+
+def upgrade(conn):
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_questions_image
+    ON questions(image_id) WHERE image_id IS NOT NULL''')
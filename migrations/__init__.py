@@ -0,0 +1,132 @@
+"""
+Миграции схемы БД.
+
+Файлы NNNN_описание.py в этом каталоге применяются по возрастанию номера,
+каждый содержит функцию upgrade(conn). Применённые версии записываются
+в таблицу schema_version.
+
+Миграции выполняет один процесс до запуска воркеров (flask migrate или хук
+on_starting в gunicorn.conf.py), воркеры при старте только сверяют версию.
+"""
+import importlib
+import os
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from database import DB_PATH, DB_BUSY_TIMEOUT_MS, configure_storage, get_connection
+
+# Применять миграции при старте воркера, если схема отстаёт. По умолчанию
+# только в режиме отладки: в продакшене их выполняет мастер gunicorn
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", os.getenv("DEBUG", "False")).lower() in ["true", "1"]
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATION_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+Migration = namedtuple('Migration', ['version', 'name', 'module'])
+
+
+def add_column_if_missing(conn, table, column, definition):
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def discover():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), f"{__name__}.{filename[:-3]}"))
+    return migrations
+
+
+def latest_version():
+    migrations = discover()
+    return migrations[-1].version if migrations else 0
+
+
+def _ensure_version_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        duration_ms REAL
+    )''')
+
+
+def current_version(conn=None):
+    conn = conn or get_connection()
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+
+
+def applied_migrations():
+    """Список (версия, имя, время применения или None) для всех известных миграций."""
+    conn = get_connection()
+    applied = {}
+    if current_version(conn):
+        applied = dict(conn.execute("SELECT version, applied_at FROM schema_version").fetchall())
+    return [(m.version, m.name, applied.get(m.version)) for m in discover()]
+
+
+def migrate(target=None):
+    """
+    Применяет недостающие миграции (до target включительно).
+
+    Каждая миграция выполняется в своей транзакции BEGIN IMMEDIATE: если
+    миграции одновременно запустят несколько процессов, второй дождётся
+    первого и пропустит уже применённые версии.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    applied = []
+    try:
+        configure_storage(conn)
+        for migration in discover():
+            if target is not None and migration.version > target:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                _ensure_version_table(conn)
+                done = conn.execute(
+                    "SELECT 1 FROM schema_version WHERE version = ?", (migration.version,)
+                ).fetchone()
+                if not done:
+                    started = time.perf_counter()
+                    importlib.import_module(migration.module).upgrade(conn)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, name, duration_ms) VALUES (?, ?, ?)",
+                        (migration.version, migration.name, round((time.perf_counter() - started) * 1000, 2))
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if not done:
+                applied.append(migration)
+                print(f"Миграция {migration.version:04d}_{migration.name} применена")
+    finally:
+        conn.close()
+    return applied
+
+
+def check_schema():
+    """
+    Проверка при старте воркера: один запрос версии вместо DDL.
+
+    Если схема отстаёт и DB_AUTO_MIGRATE включён, миграции применяются
+    здесь же; иначе выводится предупреждение.
+    """
+    version, latest = current_version(), latest_version()
+    if version >= latest:
+        return version
+    if DB_AUTO_MIGRATE:
+        migrate()
+        return latest
+    print(f"Схема БД устарела (версия {version}, требуется {latest}): выполните flask migrate")
+    return version
@@ -0,0 +1,134 @@
+import base64
+import json
+import os
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from flask import request
+from database import SQL_request, db_datetime
+from serialization import json_list_response
+
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "1000"))
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise PaginationError("Некорректный cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise PaginationError("Некорректный cursor")
+    return values
+
+
+def parse_limit():
+    limit = request.args.get('limit', PAGE_DEFAULT_LIMIT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise PaginationError("limit должен быть числом")
+    if limit < 1:
+        raise PaginationError("limit должен быть положительным")
+    return min(limit, PAGE_MAX_LIMIT)
+
+
+def parse_fields(columns):
+    """Разбирает fields=a,b в список допустимых колонок (None — все колонки)."""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in columns]
+    if unknown:
+        raise PaginationError(f"Неизвестные поля: {', '.join(unknown)}")
+    return requested
+
+
+def parse_datetime_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise PaginationError(f"{name} должен быть датой в формате ISO 8601")
+    # Даты в БД — в UTC без смещения: смещение переводим, а не отбрасываем
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return db_datetime(dt)
+
+
+def paginate(columns, from_clause, key, where=(), params=(), descending=False):
+    """
+    Постраничная выборка по ключу (keyset), без OFFSET.
+
+    Параметры:
+        columns (dict): Имя поля в ответе -> SQL-выражение
+        from_clause (str): FROM ... JOIN ...
+        key (list): Поля ответа, задающие порядок; последнее должно быть уникальным (id)
+        where (list): Дополнительные условия, объединяются через AND
+        params (list): Параметры для условий where
+        descending (bool): Порядок сортировки по ключу
+
+    Возвращает (строки, cursor следующей страницы или None).
+    """
+    limit = parse_limit()
+    fields = parse_fields(columns)
+    where = list(where)
+    params = list(params)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        values = decode_cursor(cursor, len(key))
+        key_sql = ", ".join(columns[name] for name in key)
+        placeholders = ", ".join("?" for _ in key)
+        where.append(f"({key_sql}) {'<' if descending else '>'} ({placeholders})")
+        params.extend(values)
+
+    # Поля ключа выбираем всегда: они нужны для следующего cursor
+    selected = fields if fields is not None else list(columns)
+    select_names = selected + [name for name in key if name not in selected]
+    select_sql = ", ".join(f"{columns[name]} AS {name}" for name in select_names)
+    order = " DESC" if descending else ""
+    order_sql = ", ".join(f"{columns[name]}{order}" for name in key)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    rows = SQL_request(
+        f"SELECT {select_sql} {from_clause} {where_sql} ORDER BY {order_sql} LIMIT ?",
+        params + [limit + 1],
+        fetch="all"
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][name] for name in key])
+
+    if fields is not None:
+        rows = [{name: row[name] for name in fields} for row in rows]
+    return rows, next_cursor
+
+
+def paginated_response(rows, next_cursor):
+    """
+    Тело ответа остаётся списком, как и раньше; cursor следующей
+    страницы передаётся в заголовках X-Next-Cursor и Link.
+    Длинные страницы отдаются потоком (см. serialization.py).
+    """
+    response = json_list_response(rows)
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
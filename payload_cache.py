@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from flask import g, has_request_context
+from cache import LRUCache
+from concurrency import run_blocking
+from database import DB_PATH, DB_BUSY_TIMEOUT_MS, json_loads
+from content_versions import get_content_version
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json
+    orjson = None
+
+# Уровни кэша в порядке обращения: memory — LRU воркера,
+# sqlite — общий для всех воркеров файл на локальном диске
+PAYLOAD_CACHE_BACKENDS = [
+    name.strip() for name in os.getenv("PAYLOAD_CACHE_BACKENDS", "memory,sqlite").split(",") if name.strip()
+]
+PAYLOAD_CACHE_SIZE = int(os.getenv("PAYLOAD_CACHE_SIZE", "512"))
+PAYLOAD_CACHE_PATH = os.getenv(
+    "PAYLOAD_CACHE_PATH",
+    f"{os.path.splitext(DB_PATH)[0]}-payloads.db" if DB_PATH else "payloads.db"
+)
+# Размер отображения файла кэша в память (байт)
+PAYLOAD_CACHE_MMAP_SIZE = int(os.getenv("PAYLOAD_CACHE_MMAP_SIZE", str(64 * 1024 * 1024)))
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+class MemoryPayloadBackend:
+    """Собранные ответы в памяти воркера: (вид, id, вариант) -> (версия, ответ)."""
+
+    name = 'memory'
+
+    def __init__(self, maxsize=PAYLOAD_CACHE_SIZE):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def get(self, key, version):
+        item = self._cache.get(key)
+        if item is None or item[0] != version:
+            return None
+        return item[1]
+
+    def set(self, key, version, payload):
+        self._cache.set(key, (version, payload))
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SQLitePayloadBackend:
+    """
+    Общий кэш воркеров в отдельном файле SQLite (не в основной БД):
+    ответ собирается один раз на версию, а не в каждом воркере.
+
+    Файл — только кэш: его можно удалить в любой момент, поэтому схема
+    создаётся при подключении, а не миграцией.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=PAYLOAD_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.errors = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        # Потеря кэша при сбое не страшна
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(f"PRAGMA mmap_size = {PAYLOAD_CACHE_MMAP_SIZE}")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS payloads (
+            kind TEXT NOT NULL,
+            content_id INTEGER NOT NULL,
+            variant TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            built_at REAL NOT NULL,
+            PRIMARY KEY (kind, content_id, variant)
+        ) WITHOUT ROWID''')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, version):
+        return run_blocking(self._get, key, version)
+
+    def set(self, key, version, payload):
+        run_blocking(self._set, key, version, payload)
+
+    def _get(self, key, version):
+        try:
+            row = self._connection().execute(
+                "SELECT data FROM payloads WHERE kind = ? AND content_id = ? AND variant = ? AND version = ?",
+                (*key, version)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Ошибка чтения кэша ответов: {e}")
+            return None
+        return json_loads(row[0]) if row else None
+
+    def _set(self, key, version, payload):
+        # Запись старой версии не должна затирать более новую
+        try:
+            self._connection().execute('''
+                INSERT INTO payloads (kind, content_id, variant, version, data, built_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, content_id, variant) DO UPDATE
+                SET version = excluded.version, data = excluded.data, built_at = excluded.built_at
+                WHERE excluded.version >= payloads.version
+            ''', (*key, version, _dumps(payload), time.time()))
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Ошибка записи кэша ответов: {e}")
+
+    def stats(self):
+        return {"path": self.path, "errors": self.errors}
+
+
+BACKENDS = {
+    'memory': MemoryPayloadBackend,
+    'sqlite': SQLitePayloadBackend,
+}
+
+
+class PayloadCache:
+    """
+    Read-through кэш собранных ответов по ключу (вид, id, вариант) и версии
+    из content_versions. При изменении квиза версия растёт, и следующий
+    запрос собирает ответ заново; старые записи просто перезаписываются.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "builds": 0, "build_ms_total": 0.0}
+        self.stats.update({f"hits_{backend.name}": 0 for backend in backends})
+
+    def get_or_build(self, kind, content_id, build, variant='full', version=None):
+        """
+        Возвращает ответ из кэша или собирает его через build().
+        build() возвращает None, если содержимого нет — такой ответ не кэшируется.
+        """
+        def build_variants():
+            payload = build()
+            return None if payload is None else {variant: payload}
+        return self.get_or_build_variants(kind, content_id, build_variants, variant, version)
+
+    def get_or_build_variants(self, kind, content_id, build_variants, variant, version=None):
+        """
+        То же для ответа с несколькими вариантами: build_variants() собирает
+        сразу все ({вариант: ответ} или None), и все они попадают в кэш.
+        """
+        if version is None:
+            version = get_content_version(kind, content_id)
+            # ETag ответа строится по этой же версии (middleware._content_etag):
+            # повторное чтение могло бы увидеть уже следующую
+            if has_request_context():
+                g.content_version = (kind, content_id, version)
+        key = (kind, content_id, variant)
+        with self._lock:
+            self.stats["requests"] += 1
+
+        for level, backend in enumerate(self.backends):
+            payload = backend.get(key, version)
+            if payload is not None:
+                with self._lock:
+                    self.stats[f"hits_{backend.name}"] += 1
+                # Заполняем более быстрые уровни
+                for faster in self.backends[:level]:
+                    faster.set(key, version, payload)
+                return payload
+
+        started = time.perf_counter()
+        variants = build_variants()
+        with self._lock:
+            self.stats["builds"] += 1
+            self.stats["build_ms_total"] += (time.perf_counter() - started) * 1000
+        if variants is None:
+            return None
+        for name, payload in variants.items():
+            for backend in self.backends:
+                backend.set((kind, content_id, name), version, payload)
+        return variants[variant]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        hits = sum(stats[f"hits_{backend.name}"] for backend in self.backends)
+        stats["hit_ratio"] = round(hits / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["build_ms_total"] = round(stats["build_ms_total"], 2)
+        stats["backends"] = {backend.name: backend.stats() for backend in self.backends}
+        return stats
+
+
+payload_cache = PayloadCache([BACKENDS[name]() for name in PAYLOAD_CACHE_BACKENDS])
+
+
+def _current_version(kind, content_id):
+    # Версию для ETag уже прочитал conditional_get (middleware.py)
+    current = g.get('content_version') if has_request_context() else None
+    if current and current[:2] == (kind, content_id):
+        return current[2]
+    return None
+
+
+def cached_payload(kind, content_id, build, variant='full'):
+    return payload_cache.get_or_build(
+        kind, content_id, build, variant=variant, version=_current_version(kind, content_id)
+    )
+
+
+# === Варианты ответа квиза ===
+# teacher — полный ответ с ключом, student — без признаков правильности
+QUIZ_VARIANTS = ('teacher', 'student')
+
+
+def quiz_variant_for_role(role):
+    return 'teacher' if role in ('teacher', 'admin') else 'student'
+
+
+def student_view(payload):
+    """
+    Копия ответа квиза без ключа ответов: у вариантов убирается is_correct,
+    а у текстовых вопросов — сами варианты (это и есть правильные ответы).
+    """
+    view = dict(payload)
+    view['questions'] = [
+        dict(question, answers=[] if question['type'] == 'text' else [
+            {name: value for name, value in answer.items() if name != 'is_correct'}
+            for answer in question.get('answers', [])
+        ])
+        for question in payload.get('questions', [])
+    ]
+    return view
+
+
+def cached_quiz_payload(kind, content_id, build, variant):
+    """
+    Ответ квиза нужного варианта. build() собирает полный ответ; вариант
+    для студентов получается из него при том же промахе и кэшируется
+    вместе с ним, поэтому ключ вырезается один раз на версию квиза.
+    """
+    if has_request_context():
+        g.payload_variant = variant
+
+    def build_variants():
+        payload = build()
+        if payload is None:
+            return None
+        return {'teacher': payload, 'student': student_view(payload)}
+
+    return payload_cache.get_or_build_variants(
+        kind, content_id, build_variants, variant, version=_current_version(kind, content_id)
+    )
+
+
+def payload_cache_stats():
+    return payload_cache.get_stats()
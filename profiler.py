@@ -0,0 +1,251 @@
+"""
+Сэмплирующий профилировщик для рабочих воркеров.
+
+Отдельный поток ОС раз в PROFILE_INTERVAL_MS снимает стеки и считает
+одинаковые стеки. Профиль сохраняется в свёрнутом виде (collapsed —
+для flamegraph.pl / speedscope) или в формате speedscope.
+
+Профиль запроса включается заголовком X-Profile: 1 от администратора
+или случайно с вероятностью PROFILE_SAMPLE_RATE и пишется в PROFILE_DIR.
+GET /admin/profile?seconds=N снимает стеки всех потоков воркера.
+
+Под gevent профиль запроса — по стенным часам: пока гринлет запроса
+ждёт (пул SQLite, сеть), снимается его приостановленный стек. Профиль
+воркера под gevent включает и стеки всех приостановленных гринлетов.
+"""
+import gc
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import Counter
+from itertools import count
+from concurrency import gevent_active, native_sleep, native_thread_id, start_native_thread
+
+try:
+    from greenlet import getcurrent, greenlet
+except ImportError:  # greenlet ставится вместе с gevent
+    getcurrent = greenlet = None
+
+# Доля профилируемых запросов (0 — только по заголовку администратора)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "olympiad-profiles"))
+# collapsed или speedscope
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "collapsed")
+# Меньше таймаута gunicorn (GUNICORN_TIMEOUT): sync-воркер не шлёт heartbeat, пока профилирует
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "25"))
+# Как часто профиль воркера заново ищет гринлеты через gc (обход всей кучи)
+PROFILE_GREENLET_REFRESH = float(os.getenv("PROFILE_GREENLET_REFRESH", "0.1"))
+PROFILE_HEADER = "X-Profile"
+
+PROFILE_FORMATS = {
+    'collapsed': ('.collapsed', 'text/plain; charset=utf-8'),
+    'speedscope': ('.speedscope.json', 'application/json'),
+}
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_UNSAFE_NAME_RE = re.compile(r'[^\w.-]+')
+# Номер профиля в процессе: имена файлов не совпадают в пределах секунды
+_profile_ids = count(1)
+# Слабые ссылки на гринлеты процесса, найденные последним обходом gc
+_greenlets = {"refs": [], "refreshed_at": 0.0}
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = os.path.relpath(filename, _ROOT)
+    else:
+        filename = os.path.basename(filename)
+    # ';' разделяет кадры в свёрнутом формате
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+
+def _stack(frame):
+    """Стек от корня к листу в виде кортежа меток."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+class StackSampler:
+    """
+    Снимает стеки в отдельном потоке ОС до вызова stop() или истечения duration.
+
+    frames() возвращает пары (префикс стека, кадр) для одного снимка:
+    префикс — кортеж меток (например, имя потока), кадр — вершина стека.
+    """
+
+    def __init__(self, frames, interval_ms=PROFILE_INTERVAL_MS, duration=None):
+        self.frames = frames
+        self.interval = interval_ms / 1000
+        self.duration = duration
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._running = False
+        self._finished = False
+
+    def start(self):
+        self._running = True
+        self.started_at = time.time()
+        start_native_thread(self._run)
+        return self
+
+    def _run(self):
+        started = time.perf_counter()
+        own_thread = native_thread_id()
+        try:
+            # Первый снимок — сразу: короткий запрос может завершиться раньше интервала
+            while True:
+                for prefix, frame in self.frames(own_thread):
+                    if frame is not None:
+                        self.samples[prefix + _stack(frame)] += 1
+                self.sample_count += 1
+                native_sleep(self.interval)
+                if not self._running:
+                    break
+                if self.duration is not None and time.perf_counter() - started >= self.duration:
+                    break
+        finally:
+            self.elapsed = time.perf_counter() - started
+            self._running = False
+            self._finished = True
+
+    def stop(self):
+        self._running = False
+
+    def wait(self):
+        """Ждёт завершения потока сэмплера (под gevent — не блокируя другие гринлеты)."""
+        while not self._finished:
+            time.sleep(min(self.interval, 0.05))
+
+    # === Форматы ===
+
+    def collapsed(self):
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self, name):
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.samples.most_common():
+            ids = []
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({"name": label})
+                ids.append(index[label])
+            samples.append(ids)
+            weights.append(round(count * self.interval * 1000, 3))
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "olympiad-api",
+        }, ensure_ascii=False)
+
+    def render(self, fmt, name):
+        return self.speedscope(name) if fmt == 'speedscope' else self.collapsed()
+
+
+# === Источники стеков ===
+
+def current_request_frames():
+    """
+    Источник стеков для запроса, выполняемого в текущем потоке (гринлете).
+    Вызывается в потоке запроса, сами снимки — в потоке сэмплера.
+    """
+    thread_id = native_thread_id()
+    glet = getcurrent() if gevent_active() and getcurrent is not None else None
+
+    def frames(own_thread):
+        # Приостановленный гринлет хранит свой стек в gr_frame,
+        # выполняющийся — это текущий кадр потока
+        if glet is not None and glet.gr_frame is not None:
+            return [((), glet.gr_frame)]
+        return [((), sys._current_frames().get(thread_id))]
+    return frames
+
+
+def _suspended_greenlets():
+    """
+    Приостановленные гринлеты процесса. Список обновляется обходом gc не
+    чаще раза в PROFILE_GREENLET_REFRESH: обход кучи дороже самого снимка.
+    """
+    now = time.perf_counter()
+    if now - _greenlets["refreshed_at"] >= PROFILE_GREENLET_REFRESH:
+        _greenlets["refs"] = [weakref.ref(obj) for obj in gc.get_objects() if isinstance(obj, greenlet)]
+        _greenlets["refreshed_at"] = now
+    for ref in _greenlets["refs"]:
+        glet = ref()
+        # Выполняющийся гринлет виден как кадр своего потока
+        if glet is not None and glet.gr_frame is not None:
+            yield glet.gr_frame
+
+
+def all_thread_frames(own_thread):
+    """
+    Стеки всех потоков процесса, кроме самого сэмплера. Под gevent
+    sys._current_frames() видит только выполняющиеся гринлеты, поэтому
+    добавляются стеки приостановленных.
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    frames = [
+        ((f"thread {names.get(thread_id, thread_id)}",), frame)
+        for thread_id, frame in sys._current_frames().items()
+        if thread_id != own_thread
+    ]
+    if gevent_active() and greenlet is not None:
+        frames.extend((("greenlet",), frame) for frame in _suspended_greenlets())
+    return frames
+
+
+# === Профили запросов ===
+
+def start_request_profile():
+    return StackSampler(current_request_frames()).start()
+
+
+def save_request_profile(sampler, method, route, fmt=PROFILE_FORMAT):
+    """Останавливает профиль запроса и пишет его в PROFILE_DIR; возвращает имя файла."""
+    sampler.stop()
+    sampler.wait()
+    if not sampler.samples:
+        return None
+    extension = PROFILE_FORMATS.get(fmt, PROFILE_FORMATS['collapsed'])[0]
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(sampler.started_at))
+    name = f"{stamp}-{os.getpid()}-{next(_profile_ids)}-{method}-{route.strip('/')}"
+    filename = _UNSAFE_NAME_RE.sub('_', name) + extension
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, filename), 'w', encoding='utf-8') as f:
+            f.write(sampler.render(fmt, f"{method} {route}"))
+    except OSError as e:
+        print(f"Ошибка записи профиля: {e}")
+        return None
+    return filename
+
+
+def profile_worker(seconds, interval_ms=PROFILE_INTERVAL_MS):
+    """Профиль всех потоков воркера за seconds секунд (блокирует только вызывающий гринлет)."""
+    sampler = StackSampler(all_thread_frames, interval_ms=interval_ms, duration=seconds).start()
+    sampler.wait()
+    return sampler
@@ -0,0 +1,142 @@
+"""
+Проверка планов SQL-запросов.
+
+Находит в исходниках все вызовы SQL_request с запросом-литералом, выполняет
+для каждого EXPLAIN QUERY PLAN и отмечает полный перебор таблицы (SCAN)
+в запросах с условием WHERE.
+
+Запуск:
+    python query_plan.py [файлы или каталоги...]
+    flask --app api check-query-plans
+
+Код возврата 1, если найден хотя бы один полный перебор. В CI проверка
+выполняется тестом tests/test_query_plans.py.
+"""
+import ast
+import os
+import re
+import sys
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATHS = [
+    os.path.join(ROOT, name)
+    for name in ['routes', 'database.py', 'grading.py', 'images.py', 'mail.py', 'middleware.py', 'utils.py']
+]
+
+# Запросы, для которых план не строится
+SKIP_STATEMENTS = {"CREATE", "DROP", "ALTER", "PRAGMA", "ANALYZE", "VACUUM"}
+
+SCAN_RE = re.compile(r'^SCAN (\w+)')
+WHERE_RE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+
+Query = namedtuple('Query', ['path', 'line', 'sql'])
+PlanReport = namedtuple('PlanReport', ['query', 'plan', 'scans', 'error'])
+
+
+def _iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.py'):
+                    yield os.path.join(path, name)
+        elif path.endswith('.py'):
+            yield path
+
+
+def _is_sql_request(node):
+    func = node.func
+    name = func.id if isinstance(func, ast.Name) else getattr(func, 'attr', None)
+    return name == 'SQL_request'
+
+
+def collect_queries(paths=None):
+    """Возвращает (запросы-литералы, число пропущенных динамических запросов)."""
+    queries, skipped = [], 0
+    for path in _iter_files(paths or DEFAULT_PATHS):
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not _is_sql_request(node) or not node.args:
+                continue
+            arg = node.args[0]
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                statement = arg.value.split(None, 1)[0].upper()
+                if statement not in SKIP_STATEMENTS:
+                    queries.append(Query(os.path.relpath(path, ROOT), node.lineno, arg.value))
+            else:
+                # f-строки и переменные: текст запроса известен только при выполнении
+                skipped += 1
+    return queries, skipped
+
+
+def explain(conn, query):
+    params = [None] * query.sql.count('?')
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query.sql}", params).fetchall()
+    except Exception as e:
+        return PlanReport(query, [], [], str(e))
+
+    plan = [row[3] for row in rows]
+    scans = []
+    if WHERE_RE.search(query.sql):
+        scans = [match.group(1) for match in (SCAN_RE.match(detail) for detail in plan) if match]
+    return PlanReport(query, plan, scans, None)
+
+
+def audit(conn, paths=None):
+    queries, skipped = collect_queries(paths)
+    return [explain(conn, query) for query in queries], skipped
+
+
+def format_report(reports, skipped, verbose=False):
+    lines = []
+    for report in reports:
+        location = f"{report.query.path}:{report.query.line}"
+        if report.error:
+            lines.append(f"ERROR {location}: {report.error}")
+        elif report.scans:
+            lines.append(f"SCAN  {location}: {', '.join(report.scans)}")
+        elif verbose:
+            lines.append(f"OK    {location}")
+        if verbose or report.scans:
+            lines.extend(f"        {detail}" for detail in report.plan)
+
+    problems = sum(1 for report in reports if report.scans or report.error)
+    lines.append(
+        f"Запросов проверено: {len(reports)}, с полным перебором или ошибкой: {problems}, "
+        f"динамических (пропущено): {skipped}"
+    )
+    return "\n".join(lines), problems
+
+
+def main(argv=None):
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN для SQL из исходников")
+    parser.add_argument("paths", nargs="*", help="файлы или каталоги (по умолчанию routes/ и модули с SQL)")
+    parser.add_argument("--db", help="файл БД (по умолчанию — временная БД с актуальной схемой)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать планы всех запросов")
+    args = parser.parse_args(argv)
+
+    # DB_PATH читается при импорте database, поэтому задаётся заранее
+    tmp_dir = None
+    if args.db:
+        os.environ["DB_PATH"] = args.db
+    else:
+        tmp_dir = tempfile.TemporaryDirectory()
+        os.environ["DB_PATH"] = os.path.join(tmp_dir.name, "plan.db")
+
+    from database import get_connection
+    from migrations import migrate
+    migrate()
+
+    reports, skipped = audit(get_connection(), args.paths or None)
+    text, problems = format_report(reports, skipped, verbose=args.verbose)
+    print(text)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
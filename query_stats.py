@@ -0,0 +1,116 @@
+"""
+Учёт SQL-запросов: число, суммарное время и самый медленный запрос
+в рамках HTTP-запроса (flask.g), сводка по нормализованному тексту SQL
+для воркера и журнал медленных запросов.
+
+Время меряется в SQL_request в вызывающем потоке (гринлете), поэтому
+под gevent в него входит и ожидание свободного потока пула.
+"""
+import logging
+import os
+import re
+from functools import lru_cache
+from flask import g, has_request_context, request
+from concurrency import native_lock
+
+# Порог медленного запроса (мс); 0 — журнал отключён
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+# План EXPLAIN QUERY PLAN для медленных запросов (дополнительный запрос к БД)
+SQL_EXPLAIN_SLOW = os.getenv("SQL_EXPLAIN_SLOW", "False").lower() in ["true", "1"]
+# Заголовок Server-Timing с временем БД в ответах
+SQL_SERVER_TIMING = os.getenv("SQL_SERVER_TIMING", "True").lower() in ["true", "1"]
+# Сколько разных нормализованных запросов хранится в сводке воркера
+SQL_STATS_MAX_QUERIES = int(os.getenv("SQL_STATS_MAX_QUERIES", "500"))
+
+slow_query_logger = logging.getLogger('slow_sql')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+_lock = native_lock()
+_totals = {"queries": 0, "time_ms_total": 0.0, "slow": 0}
+_by_query = {}
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """
+    Текст запроса без литералов и лишних пробелов: запросы, отличающиеся
+    только значениями или длиной списка IN (?, ?, ...), сводятся к одному.
+    """
+    query = _STRING_RE.sub("?", query)
+    query = _NUMBER_RE.sub("?", query)
+    query = _SPACE_RE.sub(" ", query).strip()
+    return _IN_LIST_RE.sub("(?, ...)", query)
+
+
+def record_query(query, elapsed_ms):
+    """Учитывает выполненный запрос; возвращает True, если он медленный."""
+    sql = normalize_sql(query)
+    slow = 0 < SQL_SLOW_QUERY_MS <= elapsed_ms
+
+    if has_request_context():
+        stats = g.get('sql_stats')
+        if stats is None:
+            stats = g.sql_stats = {"count": 0, "time_ms": 0.0, "slowest_ms": 0.0, "slowest_sql": None}
+        stats["count"] += 1
+        stats["time_ms"] += elapsed_ms
+        if elapsed_ms > stats["slowest_ms"]:
+            stats["slowest_ms"] = elapsed_ms
+            stats["slowest_sql"] = sql
+
+    with _lock:
+        _totals["queries"] += 1
+        _totals["time_ms_total"] += elapsed_ms
+        _totals["slow"] += slow
+        item = _by_query.get(sql)
+        if item is None and len(_by_query) < SQL_STATS_MAX_QUERIES:
+            item = _by_query[sql] = {"count": 0, "time_ms_total": 0.0, "time_ms_max": 0.0, "slow": 0}
+        if item is not None:
+            item["count"] += 1
+            item["time_ms_total"] += elapsed_ms
+            item["time_ms_max"] = max(item["time_ms_max"], elapsed_ms)
+            item["slow"] += slow
+    return slow
+
+
+def log_slow_query(query, elapsed_ms, plan=None):
+    location = f"{request.method} {request.path} " if has_request_context() else ""
+    message = f"Медленный SQL {elapsed_ms:.1f}ms {location}| {normalize_sql(query)}"
+    if plan:
+        message += " | план: " + "; ".join(plan)
+    slow_query_logger.warning(message)
+
+
+def request_sql_stats():
+    """Счётчики SQL текущего HTTP-запроса (нули, если запросов не было)."""
+    stats = g.get('sql_stats') if has_request_context() else None
+    return stats or {"count": 0, "time_ms": 0.0, "slowest_ms": 0.0, "slowest_sql": None}
+
+
+def server_timing(stats):
+    """Значение заголовка Server-Timing: время и число запросов к БД."""
+    return (
+        f'db;dur={stats["time_ms"]:.2f};desc="{stats["count"]} queries", '
+        f'db-max;dur={stats["slowest_ms"]:.2f}'
+    )
+
+
+def query_stats(top=20):
+    """Сводка воркера и самые затратные по суммарному времени запросы."""
+    with _lock:
+        totals = dict(_totals)
+        items = [dict(item, sql=sql) for sql, item in _by_query.items()]
+    items.sort(key=lambda item: item["time_ms_total"], reverse=True)
+    for item in items:
+        item["time_ms_avg"] = round(item["time_ms_total"] / item["count"], 3)
+        item["time_ms_total"] = round(item["time_ms_total"], 2)
+        item["time_ms_max"] = round(item["time_ms_max"], 2)
+    totals["time_ms_total"] = round(totals["time_ms_total"], 2)
+    totals["distinct_queries"] = len(items)
+    totals["slow_threshold_ms"] = SQL_SLOW_QUERY_MS
+    totals["top"] = items[:top]
+    totals["pid"] = os.getpid()
+    return totals
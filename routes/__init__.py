@@ -2,3 +2,4 @@ from .main_routes import *
 from .user_routes import *
 from .test_routes import *
 from .olympiad_routes import *
+from .image_routes import *
@@ -0,0 +1,142 @@
+from .main_routes import *
+from datetime import datetime
+from flask import Response, send_file
+from werkzeug.http import http_date
+from images import (
+    load_image, iter_image_data, get_stored_image, image_path, variant_mime_type,
+    safe_mime_type, image_olympiad_starts, IMAGE_VARIANTS
+)
+
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+STORED_IMAGE_MAX_AGE = 365 * 24 * 3600
+
+
+def _image_headers(meta):
+    headers = {
+        "ETag": f'"{meta.etag}"',
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        # Браузер не должен угадывать тип по содержимому
+        "X-Content-Type-Options": "nosniff",
+    }
+    if meta.last_modified:
+        headers["Last-Modified"] = http_date(meta.last_modified)
+    return headers
+
+
+def _not_modified(meta):
+    if request.if_none_match:
+        return request.if_none_match.contains(meta.etag)
+    if meta.last_modified and request.if_modified_since:
+        return meta.last_modified <= request.if_modified_since
+    return False
+
+
+def _requested_range(meta):
+    """Возвращает (start, stop) для Range-запроса, None — отдать целиком, False — 416."""
+    if request.range is None or request.range.units != "bytes":
+        return None
+    # If-Range с устаревшим валидатором: отдаём изображение целиком
+    if request.if_range and request.if_range.etag and request.if_range.etag != meta.etag:
+        return None
+    byte_range = request.range.range_for_length(meta.size)
+    return byte_range if byte_range is not None else False
+
+
+def _olympiad_started(start_time):
+    try:
+        return datetime.strptime(start_time, '%d-%m-%Y %H:%M') <= datetime.utcnow()
+    except (TypeError, ValueError):
+        return False
+
+
+# Отдача изображения вопроса или новости. Изображения вопросов олимпиад —
+# с теми же правами, что и сама олимпиада: только после входа, а студентам —
+# только после начала олимпиады (id последовательные и легко перебираются)
+@api.route('/images/<int:image_id>', methods=['GET'])
+def get_image(image_id):
+    try:
+        olympiad_starts = image_olympiad_starts(image_id)
+    except Exception as e:
+        logger.error(f"Ошибка проверки доступа к изображению {image_id}: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+    if olympiad_starts:
+        return _get_olympiad_image(image_id, olympiad_starts)
+    return _send_image(image_id)
+
+
+@auth_decorator()
+def _get_olympiad_image(image_id, olympiad_starts):
+    if g.user['role'] not in ('teacher', 'admin') and not any(map(_olympiad_started, olympiad_starts)):
+        return jsonify({"error": "Изображение не найдено"}), 404
+    response = _send_image(image_id)
+    # Доступ зависит от токена: общие кэши не должны хранить ответ
+    if isinstance(response, Response):
+        response.headers['Cache-Control'] = "private, max-age=86400"
+    return response
+
+
+def _send_image(image_id):
+    try:
+        meta, data = load_image(image_id)
+        if meta is None:
+            return jsonify({"error": "Изображение не найдено"}), 404
+
+        headers = _image_headers(meta)
+        if _not_modified(meta):
+            return Response(status=304, headers=headers)
+
+        byte_range = _requested_range(meta)
+        if byte_range is False:
+            headers["Content-Range"] = f"bytes */{meta.size}"
+            return Response(status=416, headers=headers)
+
+        status = 200
+        start, stop = 0, meta.size
+        if byte_range:
+            start, stop = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{meta.size}"
+        headers["Content-Length"] = str(stop - start)
+
+        if data is not None:
+            body = data[start:stop]
+        else:
+            body = iter_image_data(image_id, start, stop)
+        return Response(body, status=status, mimetype=safe_mime_type(meta.mime_type), headers=headers, direct_passthrough=True)
+
+    except Exception as e:
+        logger.error(f"Ошибка отдачи изображения {image_id}: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
+
+# Отдача изображения из хранилища по SHA-256 (и его вариантов)
+@api.route('/images/<string:image_hash>', methods=['GET'])
+@api.route('/images/<string:image_hash>/<string:variant>', methods=['GET'])
+def get_stored_image_file(image_hash, variant=None):
+    try:
+        image = get_stored_image(image_hash)
+        if image is None:
+            return jsonify({"error": "Изображение не найдено"}), 404
+        
+        if variant is not None and (variant not in IMAGE_VARIANTS or variant not in image.variants):
+            return jsonify({"error": "Вариант изображения не найден"}), 404
+        
+        # Содержимое по хешу не меняется, поэтому кэшируем "навсегда";
+        # send_file сам обрабатывает If-None-Match и Range
+        response = send_file(
+            image_path(image.sha256, variant),
+            mimetype=variant_mime_type(image, variant),
+            etag=f"{image.sha256}-{variant or 'original'}",
+            last_modified=image.last_modified,
+            max_age=STORED_IMAGE_MAX_AGE,
+            conditional=True
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+    except Exception as e:
+        logger.error(f"Ошибка отдачи изображения {image_hash}: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
@@ -1,4 +1,4 @@
-from database import SQL_request
+from database import SQL_request, pool_stats, storage_stats
 from flask import Blueprint, jsonify, request, abort, g, send_file
 from functools import wraps
 from flask_jwt_extended import jwt_required, get_jwt_identity
@@ -6,11 +6,21 @@ from werkzeug.security import check_password_hash, generate_password_hash
 import jwt
 import datetime
 import logging
-from mail import send_email
-from middleware import setup_middleware, auth_decorator
+from mail import send_email, mail_stats
+from middleware import setup_middleware, auth_decorator, auth_cache_stats, audit_log_stats
+from grading import answer_key_stats
+from hashing import hashing_stats
+from payload_cache import payload_cache_stats
+from concurrency import blocking_pool_stats
+from images import image_cache_stats
+from query_stats import query_stats
+from metrics import METRICS_TOKEN, render_metrics
+from profiler import PROFILE_FORMATS, PROFILE_INTERVAL_MS, PROFILE_MAX_SECONDS, profile_worker
+import hmac
 import config
 from utils import *
 import io
+import os
 
 
 SECRET_KEY = config.SECRET_KEY
@@ -20,4 +30,73 @@ api = Blueprint('api', __name__)
 
 @api.route('/', methods=['GET'])
 def example():
-    return jsonify({"message": f"API Работает. Версия: {config.VERSION}"}), 200
\ No newline at end of file
+    return jsonify({"message": f"API Работает. Версия: {config.VERSION}"}), 200
+
+
+# Внутренняя статистика воркера (пул соединений и т.д.)
+@api.route('/admin/stats', methods=['GET'])
+@auth_decorator('admin')
+def admin_stats():
+    return jsonify({
+        "db_pool": pool_stats(),
+        "db_storage": storage_stats(),
+        "answer_keys": answer_key_stats(),
+        "auth_cache": auth_cache_stats(),
+        "audit_log": audit_log_stats(),
+        "mail": mail_stats(),
+        "hashing": hashing_stats(),
+        "image_cache": image_cache_stats(),
+        "payload_cache": payload_cache_stats(),
+        "blocking_pool": blocking_pool_stats(),
+        "sql": query_stats()
+    }), 200
+
+
+# Метрики Prometheus по всем воркерам (см. metrics.py)
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus приходит со статическим токеном METRICS_TOKEN, люди — с JWT администратора
+    auth_header = request.headers.get('Authorization', '')
+    if METRICS_TOKEN and hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return _metrics_response()
+    return _admin_metrics()
+
+
+@auth_decorator('admin')
+def _admin_metrics():
+    return _metrics_response()
+
+
+def _metrics_response():
+    try:
+        return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    except Exception as e:
+        logger.error(f"Ошибка сбора метрик: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
+
+# Профиль всех потоков воркера, принявшего запрос (см. profiler.py)
+@api.route('/admin/profile', methods=['GET'])
+@auth_decorator('admin')
+def admin_profile():
+    try:
+        seconds = request.args.get('seconds', 10, type=float)
+        interval_ms = request.args.get('interval_ms', PROFILE_INTERVAL_MS, type=float)
+        fmt = request.args.get('format', 'collapsed')
+        if seconds is None or not 0 < seconds <= PROFILE_MAX_SECONDS:
+            return jsonify({"error": f"seconds должен быть от 0 до {PROFILE_MAX_SECONDS}"}), 400
+        if interval_ms is None or interval_ms < 1:
+            return jsonify({"error": "interval_ms должен быть не меньше 1"}), 400
+        if fmt not in PROFILE_FORMATS:
+            return jsonify({"error": f"format: {', '.join(PROFILE_FORMATS)}"}), 400
+
+        sampler = profile_worker(seconds, interval_ms)
+        extension, mimetype = PROFILE_FORMATS[fmt]
+        logger.info(f"Профиль воркера {os.getpid()}: {sampler.sample_count} снимков за {sampler.elapsed:.1f}s")
+        return sampler.render(fmt, f"worker {os.getpid()}"), 200, {
+            "Content-Type": mimetype,
+            "Content-Disposition": f'attachment; filename="profile-{os.getpid()}{extension}"',
+        }
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
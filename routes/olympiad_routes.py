@@ -1,19 +1,33 @@
 from .main_routes import *
-from database import SQL_request
+from database import SQL_request, db_datetime, load_quiz_questions
+from images import allowed_file, store_image
+from content_versions import bump_content_version
+from payload_cache import cached_quiz_payload, quiz_variant_for_role
+from pagination import paginate, paginated_response, parse_datetime_arg, PaginationError
+from grading import AttemptState, get_answer_key, invalidate_answer_key, compute_grade, grade_olympiad
 import json
 from datetime import datetime
-import re
-import ast
-
-def normalize_string(text):
-    if text is None:
-        return ""
-    text = str(text).lower()
-    text = re.sub(r'[^\w]', '', text)
-    return text
 
 # Создание олимпиады
 
+OLYMPIAD_LIST_COLUMNS = {
+    field: field for field in [
+        'id', 'title', 'description', 'creator_id', 'grading_system',
+        'start_time', 'end_time', 'duration'
+    ]
+}
+
+OLYMPIAD_RESULT_COLUMNS = {
+    'id': 'r.id',
+    'olympiad_id': 'r.olympiad_id',
+    'start_time': 'r.start_time',
+    'end_time': 'r.end_time',
+    'score': 'r.score',
+    'total_score': 'r.total_score',
+    'grade': 'r.grade',
+    'olympiad_title': 'o.title',
+}
+
 # Получение списка олимпиад
 @api.route('/olympiads', methods=['GET'])
 @auth_decorator()
@@ -22,21 +36,24 @@ def get_olympiads():
         # Для студентов: только доступные олимпиады
         # Для преподавателей: все олимпиады
         now = datetime.utcnow().isoformat()
+        where, params = [], []
         
-        if g.user and g.user['role'] in ['teacher', 'admin']:
-            olympiads = SQL_request(
-                "SELECT * FROM olympiads",
-                fetch="all"
-            )
-        else:
-            olympiads = SQL_request(
-                "SELECT * FROM olympiads WHERE start_time <= ? AND end_time >= ?",
-                (now, now),
-                fetch="all"
-            )
+        if not (g.user and g.user['role'] in ['teacher', 'admin']):
+            where.append("start_time <= ? AND end_time >= ?")
+            params.extend([now, now])
+        
+        if request.args.get('creator_id'):
+            where.append("creator_id = ?")
+            params.append(request.args['creator_id'])
         
-        return jsonify(olympiads), 200
+        olympiads, next_cursor = paginate(
+            OLYMPIAD_LIST_COLUMNS, "FROM olympiads", key=['id'], where=where, params=params
+        )
+        
+        return paginated_response(olympiads, next_cursor), 200
 
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка получения списка олимпиад: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
@@ -62,26 +79,23 @@ def add_question_to_olympiad(olympiad_id):
             return jsonify({"error": "Необходимы содержание, тип и баллы вопроса"}), 400
         
         # Обработка изображения вопроса
-        image_id = None
-        if 'image' in files:
-            filename = save_question_image(files['image'])
-            if filename:
-                image_id = SQL_request('''
-                    INSERT INTO images (data, mime_type)
-                    VALUES (?, ?)
-                    RETURNING id
-                ''', (files['image'].read(), files['image'].content_type), fetch='one')["id"]
+        # Файл сохраняется в хранилище по SHA-256, повторы не дублируются
+        image_hash = None
+        if 'image' in files and allowed_file(files['image'].filename):
+            image_hash = store_image(files['image'].read(), files['image'].mimetype)
+            if image_hash is None:
+                return jsonify({"error": "Файл не является изображением (PNG, JPEG, GIF, WebP)"}), 400
         
         # Создание вопроса
         question_id = SQL_request('''
-            INSERT INTO questions (content, type, points, image_id)
+            INSERT INTO questions (content, type, points, image_hash)
             VALUES (?, ?, ?, ?)
             RETURNING id
         ''', (
             data['content'],
             data['type'],
             int(data['points']),
-            image_id
+            image_hash
         ), fetch="one")["id"]
 
         # Добавление вариантов ответов
@@ -101,6 +115,8 @@ def add_question_to_olympiad(olympiad_id):
             INSERT INTO olympiad_questions (olympiad_id, question_id)
             VALUES (?, ?)
         ''', (olympiad_id, question_id))
+        invalidate_answer_key('olympiad', olympiad_id)
+        bump_content_version('olympiad', olympiad_id)
         
         logger.info(f"Добавлен вопрос ID {question_id} в олимпиаду {olympiad_id}")
         return jsonify({"message": "Вопрос добавлен", "question_id": question_id}), 201
@@ -116,44 +132,27 @@ def get_olympiad(olympiad_id):
         # Для студентов: только доступные олимпиады
         # Для преподавателей: все олимпиады
         now = datetime.utcnow().isoformat()
-        
-        if g.user and g.user['role'] in ['teacher', 'admin']:
-            olympiads = SQL_request(
-                "SELECT * FROM olympiads WHERE id = ?", (olympiad_id,),
-                fetch="one"
-            )
-        else:
-            olympiads = SQL_request(
-                "SELECT * FROM olympiads WHERE start_time <= ? AND end_time >= ? and id = ?",
-                (now, now, olympiad_id),
-                fetch="one"
-            )
 
-        if olympiads is None:
-            return jsonify({"error":"Олимпиада не найдена"}), 400
+        def build():
+            olympiad = SQL_request("SELECT * FROM olympiads WHERE id = ?", (olympiad_id,), fetch="one")
+            if olympiad is not None:
+                # Вопросы и варианты ответов загружаются пакетно
+                olympiad['questions'] = load_quiz_questions('olympiad', olympiad_id)
+            return olympiad
 
+        # Дерево вопросов собирается один раз на версию олимпиады;
+        # студенты получают вариант без правильных ответов
+        variant = quiz_variant_for_role(g.user['role'] if g.user else None)
+        olympiad = cached_quiz_payload('olympiad', olympiad_id, build, variant)
 
-        questions = SQL_request('''
-            SELECT q.id, q.content, q.type, q.points, q.image_id
-            FROM questions q
-            JOIN olympiad_questions tq ON q.id = tq.question_id
-            WHERE tq.olympiad_id = ?
-            ORDER BY tq.rowid
-        ''', (olympiad_id,), fetch="all")
-        
-        # Для каждого вопроса получаем варианты ответов
-        for question in questions:
-            answers = SQL_request('''
-                SELECT id, content, is_correct
-                FROM answers
-                WHERE question_id = ?
-                ORDER BY id
-            ''', (question['id'],), fetch="all")
-            question['answers'] = answers
-        
-        olympiads['questions'] = questions
-        
-        return jsonify(olympiads), 200
+        if olympiad is not None and variant == 'student':
+            if not (olympiad['start_time'] <= now and olympiad['end_time'] >= now):
+                olympiad = None
+
+        if olympiad is None:
+            return jsonify({"error":"Олимпиада не найдена"}), 400
+
+        return jsonify(olympiad), 200
 
     except Exception as e:
         print(f"Ошибка получения списка олимпиад: {str(e)}")
@@ -260,8 +259,8 @@ def start_olympiad(olympiad_id):
             (
                 g.user['id'],
                 olympiad_id,
-                now.isoformat(),
-                end_time.isoformat(),
+                db_datetime(now),
+                db_datetime(end_time),
                 # Расчет максимального балла
                 SQL_request(
                     "SELECT SUM(points) FROM questions q JOIN olympiad_questions oq ON q.id = oq.question_id WHERE oq.olympiad_id = ?",
@@ -342,76 +341,18 @@ def finish_olympiad(result_id):
         
         olympiad_id = active_attempt['olympiad_id']
         
-        # Получаем все вопросы олимпиады с правильными ответами
-        questions = SQL_request('''
-            SELECT q.id, q.points, q.type,
-                   GROUP_CONCAT(a.id) as correct_answers
-            FROM questions q
-            JOIN olympiad_questions oq ON q.id = oq.question_id
-            LEFT JOIN answers a ON a.question_id = q.id AND a.is_correct = 1
-            WHERE oq.olympiad_id = ?
-            GROUP BY q.id
-        ''', (olympiad_id,), fetch="all")
-        
-        # Рассчитываем максимальный балл
-        total_score = sum(q['points'] for q in questions)
-        
-        # Получаем ответы пользователя
-        user_answers = SQL_request('''
-            SELECT question_id, answer_ids, answer_text
-            FROM user_answers
-            WHERE result_id = ? AND is_olympiad = 1
-        ''', (result_id,), fetch="all")
-        
-        # Подсчет набранных баллов
-        score = 0
-        for question in questions:
-            question_id = question['id']
-            user_answer = next((a for a in user_answers if a['question_id'] == question_id), None)
-            if not user_answer:
-                continue
-
-            if question['type'] == 'text':
-                answer_text = user_answer["answer_text"]
-                correct_answer = SQL_request('''
-                    SELECT content FROM answers 
-                    WHERE question_id = ? AND is_correct = 1
-                ''', (question_id,), fetch="one")
-                if correct_answer:
-                    norm_correct = normalize_string(correct_answer['content'])
-                    norm_user = normalize_string(answer_text)
-                    if norm_correct == norm_user:
-                        score += question['points']
-            
-            elif question['type'] == 'single':
-                correct_id = question['correct_answers']
-                if correct_id and user_answer['answer_ids']:
-                    user_choice = ast.literal_eval(user_answer['answer_ids'])[0]
-                    if int(user_choice) == int(correct_id):
-                        score += question['points']
-            
-            elif question['type'] == 'multiple':
-                correct_ids = [int(x) for x in question['correct_answers'].split(',')] if question['correct_answers'] else []
-                user_ids = ast.literal_eval(user_answer['answer_ids']) if user_answer['answer_ids'] else []
-                if sorted(correct_ids) == sorted(user_ids):
-                    score += question['points']
-
-        # Получаем систему оценивания
-        grading_system = SQL_request('''
-            SELECT grading_system FROM olympiads WHERE id = ?
-        ''', (olympiad_id,), fetch="one")['grading_system']
-        grading_system = json.loads(grading_system) if isinstance(grading_system, str) else grading_system
-        
-        # Определяем оценку
-        percentage = (score / total_score) * 100 if total_score > 0 else 0
-        grade = None
-        print(grading_system)
-        print(percentage)
-        for g_grade, g_percent in sorted(grading_system.items(), key=lambda x: x[1], reverse=True):
-            if percentage >= g_percent:
-                grade = g_grade
-                break
-        print(grade)
+        # Ключ ответов собирается один раз и хранится в кэше воркера
+        answer_key = get_answer_key('olympiad', olympiad_id)
+        if answer_key is None:
+            return jsonify({"error": "Олимпиада не найдена"}), 404
+        total_score = answer_key.total_score
+        
+        # Ответы пользователя, проиндексированные по вопросам
+        attempt = AttemptState.load(result_id, is_olympiad=True)
+        
+        # Подсчет набранных баллов и оценки
+        score = answer_key.score(attempt)
+        percentage, grade = answer_key.grade(score)
         
         # Обновляем результат
         SQL_request('''
@@ -436,6 +377,34 @@ def finish_olympiad(result_id):
         logger.error(f"Ошибка завершения олимпиады: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+# Закрытие олимпиады: массовая проверка всех попыток
+@api.route('/olympiads/<int:olympiad_id>/close', methods=['POST'])
+@auth_decorator('teacher')
+def close_olympiad(olympiad_id):
+    try:
+        olympiad = SQL_request('SELECT creator_id FROM olympiads WHERE id = ?', (olympiad_id,), fetch="one")
+        if not olympiad:
+            return jsonify({"error": "Олимпиада не найдена"}), 404
+        
+        if olympiad['creator_id'] != g.user['id'] and g.user['role'] != 'admin':
+            return jsonify({"error": "Нет прав на закрытие этой олимпиады"}), 403
+        
+        # Идущие попытки обрываются только явно: ?force=1
+        force = request.args.get('force', 'false').lower() in ['true', '1']
+        summary = grade_olympiad(olympiad_id, force=force)
+        if summary is None:
+            return jsonify({"error": "Олимпиада не найдена"}), 404
+        
+        logger.info(
+            f"Олимпиада {olympiad_id} закрыта пользователем {g.user['id']}: проверено попыток {summary['graded']}, "
+            f"идущих {summary['active']}, пропущено {summary['skipped']}" + (" (принудительно)" if force else "")
+        )
+        return jsonify({"message": "Олимпиада закрыта", **summary}), 200
+
+    except Exception as e:
+        logger.error(f"Ошибка закрытия олимпиады {olympiad_id}: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
 # Проверка олимпиады преподавателем
 @api.route('/olympiads/results/<int:result_id>/review', methods=['POST'])
 @auth_decorator('teacher')
@@ -468,13 +437,8 @@ def review_olympiad(result_id):
             return jsonify({"error": "Превышено количество баллов"}), 400
         
         # Расчет оценки
-        grading_system = (olymoiad['grading_system'])
         percentage = (total_score / result['total_score']) * 100
-        grade = None
-        for g_grade, g_percent in sorted(grading_system.items(), key=lambda x: x[1], reverse=True):
-            if percentage >= g_percent:
-                grade = g_grade
-                break
+        grade = compute_grade(olymoiad['grading_system'], percentage)
         # Обновление общего результата
         SQL_request(
             "UPDATE olympiad_results SET score = ?, grade = ?, is_checked = 1 WHERE id = ?",
@@ -564,17 +528,27 @@ def get_user_olympiad_results(user_id):
         if g.user['id'] != user_id and g.user['role'] != 'teacher':
             return jsonify({"error": "Доступ запрещен"}), 403
         
-        results = SQL_request('''
-            SELECT r.id, r.olympiad_id, r.start_time, r.end_time,
-                   r.score, r.total_score, r.grade,
-                   o.title as olympiad_title
-            FROM olympiad_results r
-            JOIN olympiads o ON r.olympiad_id = o.id
-            WHERE r.user_id = ?
-            ORDER BY r.end_time DESC
-        ''', (user_id,), fetch="all")
-        
-        return jsonify(results), 200
+        where, params = ["r.user_id = ?"], [user_id]
+        
+        # Окно по времени завершения: since/until в ISO 8601
+        since = parse_datetime_arg('since')
+        if since:
+            where.append("r.end_time >= ?")
+            params.append(since)
+        until = parse_datetime_arg('until')
+        if until:
+            where.append("r.end_time < ?")
+            params.append(until)
+        
+        results, next_cursor = paginate(
+            OLYMPIAD_RESULT_COLUMNS,
+            "FROM olympiad_results r JOIN olympiads o ON r.olympiad_id = o.id",
+            key=['end_time', 'id'], where=where, params=params, descending=True
+        )
+        
+        return paginated_response(results, next_cursor), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка получения результатов олимпиад пользователя {user_id}: {str(e)}")
-        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
\ No newline at end of file
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
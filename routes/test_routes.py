@@ -1,51 +1,51 @@
 from flask import request, jsonify, g, abort
 from . import api, SQL_request, auth_decorator, logger
+from database import load_quiz_questions, load_quiz_answers
+from images import allowed_file, store_image
+from content_versions import bump_content_version
+from payload_cache import cached_payload, cached_quiz_payload
+from middleware import quiz_payload_variant
+from pagination import paginate, paginated_response, parse_datetime_arg, PaginationError
+from grading import AttemptState, get_answer_key, invalidate_answer_key
 import json
 from datetime import datetime
 import sqlite3
-from werkzeug.utils import secure_filename
-import os
-from config import UPLOAD_FOLDER, ALLOWED_EXTENSIONS
-import ast
-import re
 
-# Вспомогательные функции
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def normalize_string(text):
-    if text is None:
-        return ""
-    text = str(text).lower()
-    text = re.sub(r'[^\w]', '', text)
-    return text
-
-
-def save_question_image(file):
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, 'questions', filename)
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        file.save(filepath)
-        return filename
-    return None
+TEST_LIST_COLUMNS = {
+    'id': 't.id',
+    'title': 't.title',
+    'description': 't.description',
+    'grading_system': 't.grading_system',
+    'is_open': 't.is_open',
+    'creator_id': 'u.id',
+    'creator_first_name': 'u.first_name',
+    'creator_last_name': 'u.last_name',
+}
 
 # Роуты для тестов
 @api.route('/tests', methods=['GET'])
 def get_tests():
     try:
-        # Получаем список всех тестов с информацией о создателе
-        tests = SQL_request('''
-            SELECT t.id, t.title, t.description, t.grading_system, t.is_open,
-                   u.id as creator_id, u.first_name as creator_first_name, 
-                   u.last_name as creator_last_name
-            FROM tests t
-            JOIN users u ON t.creator_id = u.id
-            WHERE t.is_open = 1
-        ''', fetch="all")
-        
-        return jsonify(tests), 200
+        # Открытые тесты с информацией о создателе, постранично
+        where, params = ["t.is_open = 1"], []
+        if request.args.get('creator_id'):
+            where.append("t.creator_id = ?")
+            params.append(request.args['creator_id'])
+        
+        def page():
+            tests, next_cursor = paginate(
+                TEST_LIST_COLUMNS, "FROM tests t JOIN users u ON t.creator_id = u.id",
+                key=['id'], where=where, params=params
+            )
+            return {"tests": tests, "next_cursor": next_cursor}
+        
+        # В кэше только первая страница без параметров — её запрашивает
+        # большинство клиентов; остальные страницы — один запрос по ключу
+        result = cached_payload('tests', 0, page, variant='first-page') if not request.args else page()
+        
+        return paginated_response(result["tests"], result["next_cursor"]), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка получения списка тестов: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
@@ -73,6 +73,8 @@ def create_test():
             data.get('is_open', True)
         ), fetch="one")["id"]
         
+        bump_content_version('tests')
+        
         logger.info(f"Создан новый тест ID {test_id} пользователем {g.user['id']}")
         return jsonify({"message": "Тест создан", "test_id": test_id}), 201
     except Exception as e:
@@ -82,40 +84,27 @@ def create_test():
 @api.route('/tests/<int:test_id>', methods=['GET'])
 def get_test(test_id):
     try:
-        # Получаем основную информацию о тесте
-        test = SQL_request('''
-            SELECT t.id, t.title, t.description, t.grading_system, t.is_open,
-                   u.id as creator_id, u.first_name as creator_first_name, 
-                   u.last_name as creator_last_name
-            FROM tests t
-            JOIN users u ON t.creator_id = u.id
-            WHERE t.id = ?
-        ''', (test_id,), fetch="one")
-        
+        def build():
+            # Получаем основную информацию о тесте
+            test = SQL_request('''
+                SELECT t.id, t.title, t.description, t.grading_system, t.is_open,
+                       u.id as creator_id, u.first_name as creator_first_name, 
+                       u.last_name as creator_last_name
+                FROM tests t
+                JOIN users u ON t.creator_id = u.id
+                WHERE t.id = ?
+            ''', (test_id,), fetch="one")
+            if test is not None:
+                # Вопросы теста и варианты ответов загружаются пакетно
+                test['questions'] = load_quiz_questions('test', test_id)
+            return test
+
+        # Дерево вопросов собирается один раз на версию теста; без
+        # авторизации или для студента — вариант без правильных ответов
+        test = cached_quiz_payload('test', test_id, build, quiz_payload_variant())
         if not test:
             return jsonify({"error": "Тест не найден"}), 404
         
-        # Получаем вопросы теста
-        questions = SQL_request('''
-            SELECT q.id, q.content, q.type, q.points, q.image_id
-            FROM questions q
-            JOIN test_questions tq ON q.id = tq.question_id
-            WHERE tq.test_id = ?
-            ORDER BY tq.rowid
-        ''', (test_id,), fetch="all")
-        
-        # Для каждого вопроса получаем варианты ответов
-        for question in questions:
-            answers = SQL_request('''
-                SELECT id, content, is_correct
-                FROM answers
-                WHERE question_id = ?
-                ORDER BY id
-            ''', (question['id'],), fetch="all")
-            question['answers'] = answers
-        
-        test['questions'] = questions
-        
         return jsonify(test), 200
     except Exception as e:
         logger.error(f"Ошибка получения теста {test_id}: {str(e)}")
@@ -141,26 +130,23 @@ def add_question_to_test(test_id):
             return jsonify({"error": "Необходимы содержание, тип и баллы вопроса"}), 400
         
         # Обработка изображения вопроса
-        image_id = None
-        if 'image' in files:
-            filename = save_question_image(files['image'])
-            if filename:
-                image_id = SQL_request('''
-                    INSERT INTO images (data, mime_type)
-                    VALUES (?, ?)
-                    RETURNING id
-                ''', (files['image'].read(), files['image'].content_type), fetch='one')["id"]
+        # Файл сохраняется в хранилище по SHA-256, повторы не дублируются
+        image_hash = None
+        if 'image' in files and allowed_file(files['image'].filename):
+            image_hash = store_image(files['image'].read(), files['image'].mimetype)
+            if image_hash is None:
+                return jsonify({"error": "Файл не является изображением (PNG, JPEG, GIF, WebP)"}), 400
         
         # Создание вопроса
         question_id = SQL_request('''
-            INSERT INTO questions (content, type, points, image_id)
+            INSERT INTO questions (content, type, points, image_hash)
             VALUES (?, ?, ?, ?)
             RETURNING id
         ''', (
             data['content'],
             data['type'],
             int(data['points']),
-            image_id
+            image_hash
         ), fetch="one")["id"]
 
         # Добавление вариантов ответов
@@ -180,6 +166,8 @@ def add_question_to_test(test_id):
             INSERT INTO test_questions (test_id, question_id)
             VALUES (?, ?)
         ''', (test_id, question_id))
+        invalidate_answer_key('test', test_id)
+        bump_content_version('test', test_id)
         
         logger.info(f"Добавлен вопрос ID {question_id} в тест {test_id}")
         return jsonify({"message": "Вопрос добавлен", "question_id": question_id}), 201
@@ -273,20 +261,10 @@ def get_test_progress(test_id):
         result_id = active_attempt['id']
         
         # Получаем все вопросы теста
-        questions = SQL_request('''
-            SELECT q.id, q.content, q.type, q.points, q.image_id
-            FROM questions q
-            JOIN test_questions tq ON q.id = tq.question_id
-            WHERE tq.test_id = ?
-            ORDER BY tq.rowid
-        ''', (test_id,), fetch="all")
+        questions = load_quiz_questions('test', test_id, with_answers=False)
         
-        # Получаем ответы пользователя
-        user_answers = SQL_request('''
-            SELECT question_id, answer_ids, answer_text
-            FROM user_answers
-            WHERE result_id = ? AND is_olympiad = 0
-        ''', (result_id,), fetch="all")
+        # Ответы пользователя, проиндексированные по вопросам
+        attempt = AttemptState.load(result_id, is_olympiad=False)
         
         # Формируем ответ
         response = {
@@ -301,23 +279,21 @@ def get_test_progress(test_id):
                 "content": question['content'],
                 "type": question['type'],
                 "points": question['points'],
-                "image_id": question['image_id']
+                "image_id": question['image_id'],
+                "image_hash": question['image_hash']
             }
             
             # Добавляем ответ пользователя, если есть
-            user_answer = next(
-                (ua for ua in user_answers if ua['question_id'] == question['id']), 
-                None
-            )
+            user_answer = attempt.get(question['id'])
             
             if user_answer:
                 if question['type'] == 'text':
                     question_data['user_answer'] = {
-                        "text": user_answer['answer_text']
+                        "text": user_answer.answer_text
                     }
                 else:
                     question_data['user_answer'] = {
-                        "answer_ids": json.loads(user_answer['answer_ids']) if user_answer['answer_ids'] else []
+                        "answer_ids": user_answer.answer_ids
                     }
             
             response['questions'].append(question_data)
@@ -379,25 +355,6 @@ def submit_test(result_id):
         
         result_id = active_attempt['id']
         
-        # Получаем все вопросы теста
-        questions = SQL_request('''
-            SELECT q.id, q.content, q.type, q.points, q.image_id
-            FROM questions q
-            JOIN test_questions tq ON q.id = tq.question_id
-            WHERE tq.test_id = ?
-            ORDER BY tq.rowid
-        ''', (result_id,), fetch="all")
-        
-        # Получаем ответы пользователя
-        user_answers = SQL_request('''
-            SELECT question_id, answer_ids, answer_text
-            FROM user_answers
-            WHERE result_id = ? AND is_olympiad = 0
-        ''', (result_id,), fetch="all")
-
-        data = {"answers":user_answers}
-
-        
         # Проверяем, что результат существует и принадлежит текущему пользователю
         result = SQL_request('''
             SELECT id, user_id, test_id, score, total_score
@@ -408,63 +365,17 @@ def submit_test(result_id):
         if not result:
             return jsonify({"error": "Результат не найден или тест уже завершен"}), 404
         
-        # Получаем вопросы теста с правильными ответами
-        questions = SQL_request('''
-            SELECT q.id, q.points, q.type,
-                   GROUP_CONCAT(a.id) as correct_answers
-            FROM questions q
-            JOIN test_questions tq ON q.id = tq.question_id
-            LEFT JOIN answers a ON a.question_id = q.id AND a.is_correct = 1
-            WHERE tq.test_id = (SELECT test_id FROM test_results WHERE id = ?)
-            GROUP BY q.id
-        ''', (result_id,), fetch="all")
-        
-        # Проверяем ответы пользователя
-        total_score = 0
-        user_answers = data.get('answers', [])
-
-        for question in questions:
-            question_id = question['id']
-            user_answer = next((a for a in user_answers if a['question_id'] == question_id), None)
-            if user_answer is None:
-                continue
-
-
-            if question['type'] == 'text':
-                answer_text = user_answer["answer_text"]
-                correct_answers = SQL_request("SELECT content FROM answers WHERE question_id = ? AND is_correct = 1", (question_id,))['content']
-                correct_answers_normalized = normalize_string(correct_answers)
-                answer_text_normalized = normalize_string(answer_text)
-                if correct_answers_normalized == answer_text_normalized:
-                    total_score += question['points']
-                    continue
-
-            correct_answers = (question['correct_answers'])
-                        
-            # Проверяем правильность ответа
-            if question['type'] == 'single':
-                user_selected = ast.literal_eval(user_answer["answer_ids"])
-                if user_selected and int(user_selected[0]) == int(correct_answers):
-                    total_score += question['points']
-            elif question['type'] == 'multiple':
-                correct_answers = [int(num.strip()) for num in correct_answers.split(",")]
-                user_selected = ast.literal_eval(user_answer["answer_ids"])
-                is_correct = sorted(correct_answers) == sorted(user_selected)
-                if is_correct:
-                    total_score += question['points']
-
-        # Получаем систему оценивания
-        grading_system = SQL_request('''
-            SELECT grading_system FROM tests WHERE id = ?
-        ''', (result['test_id'],), fetch="one")['grading_system']
+        # Ответы пользователя, проиндексированные по вопросам
+        attempt = AttemptState.load(result_id, is_olympiad=False)
+        
+        # Проверяем ответы по ключу из кэша воркера
+        answer_key = get_answer_key('test', result['test_id'])
+        if answer_key is None:
+            return jsonify({"error": "Тест не найден"}), 404
+        total_score = answer_key.score(attempt)
         
         # Определяем оценку
-        percentage = (total_score / result['total_score']) * 100
-        grade = None
-        for g_grade, g_percent in sorted(grading_system.items(), key=lambda x: x[1], reverse=True):
-            if percentage >= g_percent:
-                grade = g_grade
-                break
+        percentage, grade = answer_key.grade(total_score, result['total_score'])
         
         # Обновляем результат теста
         SQL_request('''
@@ -506,7 +417,7 @@ def get_test_result(result_id):
         
         # Получаем вопросы и ответы пользователя
         questions = SQL_request('''
-            SELECT q.id, q.content, q.type, q.points, q.image_id,
+            SELECT q.id, q.content, q.type, q.points, q.image_id, q.image_hash,
                    ua.answer_ids, ua.answer_text
             FROM questions q
             JOIN test_questions tq ON q.id = tq.question_id
@@ -515,18 +426,14 @@ def get_test_result(result_id):
             ORDER BY tq.rowid
         ''', (result_id, result['test_id']), fetch="all")
         
-        # Получаем правильные ответы для вопросов
+        # Получаем правильные ответы для всех вопросов одним запросом
+        correct_answers = load_quiz_answers('test', result['test_id'], only_correct=True)
         for question in questions:
             if question['type'] != 'text':
-                correct_answers = SQL_request('''
-                    SELECT id, content
-                    FROM answers
-                    WHERE question_id = ? AND is_correct = 1
-                ''', (question['id'],), fetch="all")
-                question['correct_answers'] = correct_answers
-            
-            if question['answer_ids']:
-                question['answer_ids'] = json.loads(question['answer_ids'])
+                question['correct_answers'] = [
+                    {"id": answer['id'], "content": answer['content']}
+                    for answer in correct_answers.get(question['id'], [])
+                ]
         
         result['questions'] = questions
         
@@ -535,21 +442,42 @@ def get_test_result(result_id):
         logger.error(f"Ошибка получения результата теста {result_id}: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+TEST_RESULT_COLUMNS = {
+    'id': 'r.id',
+    'test_id': 'r.test_id',
+    'start_time': 'r.start_time',
+    'end_time': 'r.end_time',
+    'score': 'r.score',
+    'total_score': 'r.total_score',
+    'grade': 'r.grade',
+    'test_title': 't.title',
+}
+
 @api.route('/users/<int:user_id>/tests', methods=['GET'])
 @auth_decorator()
 def get_user_test_results(user_id):
     try:
-        results = SQL_request('''
-            SELECT r.id, r.test_id, r.start_time, r.end_time,
-                   r.score, r.total_score, r.grade,
-                   t.title as test_title
-            FROM test_results r
-            JOIN tests t ON r.test_id = t.id
-            WHERE r.user_id = ?
-            ORDER BY r.end_time DESC
-        ''', (user_id,), fetch="all")
-        
-        return jsonify(results), 200
+        where, params = ["r.user_id = ?"], [user_id]
+        
+        # Окно по времени завершения: since/until в ISO 8601
+        since = parse_datetime_arg('since')
+        if since:
+            where.append("r.end_time >= ?")
+            params.append(since)
+        until = parse_datetime_arg('until')
+        if until:
+            where.append("r.end_time < ?")
+            params.append(until)
+        
+        results, next_cursor = paginate(
+            TEST_RESULT_COLUMNS,
+            "FROM test_results r JOIN tests t ON r.test_id = t.id",
+            key=['end_time', 'id'], where=where, params=params, descending=True
+        )
+        
+        return paginated_response(results, next_cursor), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка получения результатов тестов пользователя {user_id}: {str(e)}")
-        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
\ No newline at end of file
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
@@ -2,12 +2,16 @@ from .main_routes import *
 from database import register_user
 import jwt
 from config import SECRET_KEY
-import bcrypt
+from hashing import hash_password, check_password, hash_many, HASH_BULK_CHUNK, HASH_BULK_BUDGET
 import json
 import random
 import string
+import time
 from datetime import datetime, timedelta
 from mail import send_email
+from middleware import invalidate_user
+from content_versions import bump_creator_content
+from pagination import paginate, paginated_response, PaginationError
 
 # Регистрация пользователя
 @api.route('/register', methods=['POST'])
@@ -38,6 +42,20 @@ def register():
         logger.error(f"Ошибка регистрации: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+def generate_credentials():
+    login = ''.join(random.choices(string.ascii_letters, k=7))
+    password = ''.join(random.choices(string.ascii_letters + string.digits, k=7))
+    return login, password
+
+
+def send_credentials_email(email, login, password):
+    send_email(
+        to_email=email,
+        subject="Ваш аккаунт подтвержден",
+        text_body=f"Ваши данные для входа:\nЛогин: {login}\nПароль: {password}",
+        html_body=f"<p>Ваши данные для входа:</p><p><strong>Логин:</strong> {login}</p><p><strong>Пароль:</strong> {password}</p>"
+    )
+
 # Подтверждение пользователя администратором
 @api.route('/users/<int:user_id>/approve', methods=['POST'])
 @auth_decorator('admin')
@@ -49,27 +67,20 @@ def approve_user(user_id):
             return jsonify({"error": "Пользователь не найден или уже подтвержден"}), 404
 
         # Генерация логина и пароля
-        login = ''.join(random.choices(string.ascii_letters, k=7))
-        password = ''.join(random.choices(string.ascii_letters + string.digits, k=7))
+        login, password = generate_credentials()
         
-        # Хеширование пароля
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        hashed_password = hashed_password.decode('utf-8')
-
+        # Хеширование пароля в пуле процессов
+        hashed_password = hash_password(password)
         
         # Обновление пользователя
         SQL_request(
             "UPDATE users SET login = ?, password = ?, is_approved = 1 WHERE id = ?",
             (login, hashed_password, user_id)
         )
+        invalidate_user(user_id)
         
         # Отправка email с учетными данными
-        send_email(
-            to_email=user['email'],
-            subject="Ваш аккаунт подтвержден",
-            text_body=f"Ваши данные для входа:\nЛогин: {login}\nПароль: {password}",
-            html_body=f"<p>Ваши данные для входа:</p><p><strong>Логин:</strong> {login}</p><p><strong>Пароль:</strong> {password}</p>"
-        )
+        send_credentials_email(user['email'], login, password)
         
         logger.info(f"Пользователь {user_id} подтвержден администратором {g.user['id']}")
         return jsonify({"message": "Пользователь успешно подтвержден. Данные отправлены на почту."}), 200
@@ -78,6 +89,66 @@ def approve_user(user_id):
         logger.error(f"Ошибка подтверждения пользователя: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+# Массовое подтверждение пользователей (например, целого класса)
+@api.route('/users/approve', methods=['POST'])
+@auth_decorator('admin')
+def approve_users():
+    try:
+        data = request.get_json()
+        user_ids = data.get('user_ids') if data else None
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({"error": "Необходим непустой список user_ids"}), 400
+        try:
+            user_ids = [int(user_id) for user_id in user_ids]
+        except (TypeError, ValueError):
+            return jsonify({"error": "user_ids должен содержать целые числа"}), 400
+        
+        placeholders = ", ".join("?" for _ in user_ids)
+        users = SQL_request(
+            f"SELECT id, email FROM users WHERE is_approved = 0 AND id IN ({placeholders})",
+            user_ids,
+            fetch="all"
+        )
+        if not users:
+            return jsonify({"error": "Пользователи не найдены или уже подтверждены"}), 404
+        
+        # Порции хешируются параллельно в пуле и сразу сохраняются. Когда бюджет
+        # времени исчерпан, остаток возвращается в remaining — запрос не
+        # упирается в таймаут воркера, клиент отправляет остаток повторно
+        deadline = time.perf_counter() + HASH_BULK_BUDGET
+        approved = []
+        for start in range(0, len(users), HASH_BULK_CHUNK):
+            if approved and time.perf_counter() >= deadline:
+                break
+            chunk = users[start:start + HASH_BULK_CHUNK]
+            credentials = [generate_credentials() for _ in chunk]
+            hashed_passwords = hash_many([password for _, password in credentials])
+            
+            SQL_request(
+                "UPDATE users SET login = ?, password = ?, is_approved = 1 WHERE id = ?",
+                [
+                    (login, hashed_password, user['id'])
+                    for user, (login, _), hashed_password in zip(chunk, credentials, hashed_passwords)
+                ],
+                fetch="many"
+            )
+            
+            for user, (login, password) in zip(chunk, credentials):
+                invalidate_user(user['id'])
+                send_credentials_email(user['email'], login, password)
+            approved.extend(user['id'] for user in chunk)
+        
+        remaining = [user['id'] for user in users[len(approved):]]
+        logger.info(f"Пользователи {approved} подтверждены администратором {g.user['id']}")
+        message = "Пользователи подтверждены. Данные отправлены на почту."
+        if remaining:
+            message += " Не успели подтвердиться: повторите запрос для remaining."
+        return jsonify({"message": message, "approved": approved, "remaining": remaining}), 200
+
+    except Exception as e:
+        logger.error(f"Ошибка массового подтверждения пользователей: {str(e)}")
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
 # Аутентификация пользователя
 @api.route('/login', methods=['POST'])
 def login():
@@ -98,8 +169,8 @@ def login():
         if user["login"] == "admin":
             pass
         else:
-            hashed_password = user['password'].strip().encode('utf-8')  # .strip() убирает пробелы и \n
-            if not bcrypt.checkpw(data['password'].encode('utf-8'), hashed_password):
+            hashed_password = user['password'].strip()  # .strip() убирает пробелы и \n
+            if not check_password(data['password'], hashed_password):
                 return jsonify({"error": "Неверные учетные данные"}), 401
         
         # Генерация JWT токена
@@ -182,6 +253,9 @@ def update_profile():
             f"UPDATE users SET {set_clause} WHERE id = ?",
             values
         )
+        invalidate_user(g.user['id'])
+        if 'first_name' in updates or 'last_name' in updates:
+            bump_creator_content(g.user['id'])
         
         logger.info(f"Пользователь {g.user['id']} обновил профиль")
         return jsonify({"message": "Профиль успешно обновлен"}), 200
@@ -190,22 +264,42 @@ def update_profile():
         logger.error(f"Ошибка обновления профиля: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+# Поля пользователя, доступные в списке (без хеша пароля)
+USER_LIST_COLUMNS = {
+    field: field for field in [
+        'id', 'first_name', 'last_name', 'patronymic', 'email', 'phone',
+        'school', 'role', 'login', 'is_approved'
+    ]
+}
+
 # Получение списка пользователей (для администратора)
 @api.route('/users', methods=['GET'])
 @auth_decorator(role='admin')
 def get_users():
     try:
-        users = SQL_request(
-            "SELECT * FROM users",
-            fetch="all",
+        # Фильтры: role, school, is_approved
+        where, params = [], []
+        for field in ['role', 'school']:
+            if request.args.get(field):
+                where.append(f"{field} = ?")
+                params.append(request.args[field])
+        if request.args.get('is_approved') is not None:
+            where.append("is_approved = ?")
+            params.append(1 if request.args['is_approved'].lower() in ['true', '1'] else 0)
+        
+        users, next_cursor = paginate(
+            USER_LIST_COLUMNS, "FROM users", key=['id'], where=where, params=params
         )
         
         # Преобразование is_approved в boolean
         for user in users:
-            user['is_approved'] = bool(user['is_approved'])
+            if 'is_approved' in user:
+                user['is_approved'] = bool(user['is_approved'])
         
-        return jsonify(users), 200
+        return paginated_response(users, next_cursor), 200
 
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка получения списка пользователей: {str(e)}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
@@ -0,0 +1,66 @@
+import os
+from itertools import islice
+from flask import current_app, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json
+    orjson = None
+
+# Списки не короче порога отдаются потоком, по JSON_STREAM_CHUNK элементов
+JSON_STREAM_MIN_ITEMS = int(os.getenv("JSON_STREAM_MIN_ITEMS", "500"))
+JSON_STREAM_CHUNK = int(os.getenv("JSON_STREAM_CHUNK", "100"))
+
+# Даты отдаём через default(), как и стандартный провайдер Flask
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON-провайдер приложения: orjson, если установлен, без отступов
+    и без сортировки ключей. Подключается в create_app.
+    """
+
+    compact = True
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def dumps_bytes(self, obj):
+        if orjson is None:
+            return super().dumps(obj).encode('utf-8')
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def iter_json_array(items, dumps_bytes, chunk_size=JSON_STREAM_CHUNK):
+    """Сериализует список по частям: в памяти одновременно только одна порция."""
+    items = iter(items)
+    yield b"["
+    separator = b""
+    while True:
+        chunk = [dumps_bytes(item) for item in islice(items, chunk_size)]
+        if not chunk:
+            break
+        yield separator + b",".join(chunk)
+        separator = b","
+    yield b"]"
+
+
+def json_list_response(items):
+    """
+    Ответ со списком: короткие списки — обычный jsonify, длинные —
+    потоковый ответ без сборки всего тела в памяти.
+    """
+    if len(items) < JSON_STREAM_MIN_ITEMS:
+        return jsonify(items)
+    provider = current_app.json
+    dumps_bytes = getattr(provider, 'dumps_bytes', None) or (lambda item: provider.dumps(item).encode('utf-8'))
+    return current_app.response_class(iter_json_array(items, dumps_bytes), mimetype=provider.mimetype)
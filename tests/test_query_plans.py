@@ -0,0 +1,25 @@
+"""EXPLAIN QUERY PLAN для всех SQL-литералов на схеме после миграций."""
+import sqlite3
+import pytest
+import migrations
+from query_plan import audit, format_report
+
+
+@pytest.fixture
+def migrated_db(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "plan.db")
+    monkeypatch.setattr(migrations, "DB_PATH", db_path)
+    migrations.migrate()
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def test_queries_have_no_full_scans(migrated_db):
+    reports, skipped = audit(migrated_db)
+    text, problems = format_report(reports, skipped)
+
+    assert reports
+    assert not [report for report in reports if report.error], text
+    assert not [report for report in reports if report.scans], text
+    assert problems == 0, text
@@ -5,6 +5,7 @@ import random
 import string
 import secrets
 from mail import send_email
+from middleware import invalidate_user
 import json
 from datetime import datetime, timedelta
 import string
@@ -65,6 +66,8 @@ def buy_products(user, product_id, type_product, quality):
         inventory[type_product][product_id] = quality
     inventory = json.dumps(inventory)
     SQL_request("UPDATE users SET inventory = ?, balance = ? WHERE id = ? ", params=(inventory, balance, user['id']), fetch='none')
+    # Баланс проверяется по g.user: кэш пользователя должен увидеть списание
+    invalidate_user(user['id'])
     SQL_request(
             """INSERT INTO purchases (
                 user_id, product, product_id, quality, price, time_buy